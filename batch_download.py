@@ -0,0 +1,234 @@
+# -*- coding:utf-8 -*-
+
+import asyncio
+import os
+import requests
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import local
+
+try:
+    from urllib.parse import urlparse
+except:
+    from urlparse import urlparse
+
+from multiproc_download import Download
+
+
+class BatchDownload(object):
+
+    def __init__(self, items, concurrency=16, perHost=4, rangeMB=16, readMB=1, poolSize=4, blockKB=64, timeout=30):
+        """ 初始化批量下载参数
+
+        :参数 items: 下载列表 [(url, 本地文件路径), ...]，本地文件路径不能重复
+        :参数 concurrency: 所有资源共享的最大连接数，默认: 16
+        :参数 perHost: 单个服务器的最大连接数，默认: 4
+        :参数 rangeMB: 资源大小超过该值时使用多线程分片下载，否则使用单连接下载，默认: 16MB
+        :参数 readMB: 分片下载时首个分片的数据大小，默认: 1MB
+        :参数 poolSize: 单个资源分片下载的最大连接数，不超过perHost与concurrency，默认: 4
+        :参数 blockKB: 流式读取与写入文件时每次处理的数据块大小，默认: 64KB
+        :参数 timeout: 建立连接和读取数据的超时秒数，默认: 30
+        """
+
+        self.items = list(items)
+
+        # 多个资源写入同一个文件时会互相覆盖，提前拒绝
+        seen = set()
+
+        for url, filename in self.items:
+            path = os.path.abspath(filename)
+
+            if path in seen:
+                raise ValueError("本地文件路径重复: %s" % filename)
+
+            seen.add(path)
+
+        self.concurrency = concurrency
+        self.perHost = perHost
+        self.rangeBytes = rangeMB * 1024 * 1024
+        self.readMB = readMB
+        self.poolSize = max(1, min(poolSize, perHost, concurrency))
+        self.blockBytes = blockKB * 1024
+        self.timeout = timeout
+        self.local = local()
+
+
+    def get_session(self):
+        """ 获取当前线程的长连接会话
+
+        :返回: requests.Session
+        """
+
+        session = getattr(self.local, "session", None)
+
+        if session is None:
+            session = self.local.session = requests.Session()
+
+        return session
+
+
+    def head(self, url):
+        """ 查询资源大小
+
+        :参数 url: 资源地址
+        :返回: 资源字节数, 跟随重定向后的资源地址
+        """
+
+        resp = self.get_session().head(url, allow_redirects=True, timeout=self.timeout)
+        resp.raise_for_status()
+
+        return int(resp.headers["Content-Length"]), resp.url
+
+
+    def write_to_file(self, url, filename):
+        """ 单连接流式下载资源并写入本地文件，失败时删除不完整的文件
+
+        :参数 url: 资源地址
+        :参数 filename: 本地文件路径
+        """
+
+        resp = self.get_session().get(url, stream=True, timeout=self.timeout)
+
+        try:
+            resp.raise_for_status()
+
+            with open(filename, "wb") as fd:
+                for block in resp.iter_content(chunk_size=self.blockBytes):
+                    fd.write(block)
+
+        except BaseException:
+            if os.path.isfile(filename):
+                os.remove(filename)
+            raise
+
+        finally:
+            resp.close()
+
+
+    def range_download(self, url, filename):
+        """ 使用 multiproc_download.Download 分片下载资源
+
+        :参数 url: 资源地址
+        :参数 filename: 本地文件路径
+        """
+
+        # 目标文件已存在时 Download 会调用 sys.exit()，转换为该资源的下载错误，不影响其他资源
+        try:
+            Download(url, readMB=self.readMB, poolSize=self.poolSize, blockKB=self.blockBytes // 1024,
+                     timeout=self.timeout, filename=filename).get()
+        except SystemExit:
+            raise IOError("文件已存在: %s" % filename)
+
+
+    async def acquire(self, host, count):
+        """ 从全局和服务器连接配额中申请指定数量的连接，两者都有足够配额时一次性占用，不持有部分配额等待
+
+        :参数 host: 服务器地址
+        :参数 count: 连接数量
+        """
+
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.used + count <= self.concurrency and
+                                                  self.hostUsed.get(host, 0) + count <= self.perHost)
+
+            self.used += count
+            self.hostUsed[host] = self.hostUsed.get(host, 0) + count
+
+
+    async def release(self, host, count):
+        """ 归还连接配额
+
+        :参数 host: 服务器地址
+        :参数 count: 连接数量
+        """
+
+        async with self.condition:
+            self.used -= count
+            self.hostUsed[host] -= count
+            self.condition.notify_all()
+
+
+    async def fetch(self, url, filename):
+        """ 下载单个资源，按资源大小选择单连接或分片下载
+
+        :参数 url: 资源地址
+        :参数 filename: 本地文件路径
+        :返回: 下载结果 {"url", "filename", "size", "mode", "seconds", "ok", "error"}
+        """
+
+        loop = asyncio.get_event_loop()
+        host = urlparse(url).netloc
+        result = {"url": url, "filename": filename, "size": None, "mode": None, "seconds": 0, "ok": False, "error": None}
+        began = time.time()
+
+        try:
+            if os.path.isfile(filename):
+                raise IOError("文件已存在: %s" % filename)
+
+            dirname = os.path.dirname(filename)
+
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+
+            await self.acquire(host, 1)
+
+            try:
+                result["size"], resolved = await loop.run_in_executor(self.executor, self.head, url)
+            finally:
+                await self.release(host, 1)
+
+            if result["size"] > self.rangeBytes and self.poolSize > 1:
+                result["mode"], count, func = "range", self.poolSize, self.range_download
+            else:
+                result["mode"], count, func = "single", 1, self.write_to_file
+
+            await self.acquire(host, count)
+
+            # 使用跟随重定向后的地址，Download 的 HEAD 请求不跟随重定向
+            try:
+                await loop.run_in_executor(self.executor, func, resolved, filename)
+            finally:
+                await self.release(host, count)
+
+            result["ok"] = True
+
+        except Exception as e:
+            result["error"] = e
+
+        result["seconds"] = time.time() - began
+
+        return result
+
+
+    async def run(self):
+        """ 并发下载所有资源
+
+        :返回: 与下载列表顺序一致的下载结果列表
+        """
+
+        self.condition = asyncio.Condition()
+        self.used = 0
+        self.hostUsed = {}
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as self.executor:
+            return await asyncio.gather(*[ self.fetch(url, filename) for url, filename in self.items ])
+
+
+    def get(self):
+        """ 下载资源
+
+        :返回: 与下载列表顺序一致的下载结果列表
+        """
+
+        return asyncio.run(self.run())
+
+
+if __name__ == "__main__":
+    items = [
+        ("https://www.baidu.com/img/baidu_jgylogo3.gif", "./download/baidu_jgylogo3.gif"),
+        ("https://www.baidu.com/img/bd_logo1.png", "./download/bd_logo1.png"),
+    ]
+
+    for result in BatchDownload(items, concurrency=8, perHost=4).get():
+        print("%s %s %s" % (result["url"], result["ok"] and "下载成功" or "下载失败", result["error"] or ""))
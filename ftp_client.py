@@ -1,47 +1,326 @@
 #!/usr/bin/env python
 # -*- coding:utf-8 -*-
 
+import calendar
 import getopt
+import json
 import os
+import posixpath
+import socket
 import sys
+import time
 
-from ftplib import FTP
+from concurrent.futures import ThreadPoolExecutor
+from ftplib import FTP, error_perm, error_temp
+from threading import Condition, Lock, local
 
 
 class FtpClient(object):
 
-    def __init__(self, server, username, password, port=21):
+    def __init__(self, server, username, password, port=21, blockKB=256, sockBufKB=None):
         """ 初始化FTP客户端配置
 
         :参数 server: FTP服务器地址
         :参数 username: FTP服务器登陆用户名
         :参数 password: FTP服务器登陆密码
         :参数 port: FTP服务器端口, 默认: 21
+        :参数 blockKB: 数据链接每次收发的数据块大小, 每个线程复用同一块缓冲区, 默认: 256KB
+        :参数 sockBufKB: 数据链接的 SO_RCVBUF/SO_SNDBUF 大小, 默认: None (使用系统默认值)
         """
 
-        self.ftp = FTP()
-        self.ftp.connect(server, port)
-        self.ftp.login(username, password)
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self.blockBytes = blockKB * 1024
+        self.sockBufBytes = sockBufKB and sockBufKB * 1024
+        self.ftp = self.connect()
+        self.local = local()
+        self.lock = Condition()
+        self.pool = []
+        self.idle = []
+        self.poolLimit = None
+        self.opening = 0
+        self.cache = {}
+        self.mlsd = True
+
+
+    def connect(self):
+        """ 建立一个已登陆的FTP链接
+
+        :返回: FTP链接
+        """
+
+        ftp = FTP()
+        ftp.connect(self.server, int(self.port))
+        ftp.login(self.username, self.password)
+
+        return ftp
+
+
+    def get_ftp(self):
+        """ 取出一个空闲的并行传输FTP链接，没有空闲链接时新建，同一时间每个链接只被一个线程使用
+        服务器拒绝新的链接(如超过单IP链接数限制)时，等待已建立的链接空闲后继续使用
+
+        :返回: FTP链接
+        """
+
+        with self.lock:
+            while not self.idle and self.poolLimit is not None and len(self.pool) + self.opening >= self.poolLimit:
+                self.lock.wait()
+
+            if self.idle:
+                return self.idle.pop()
+
+            self.opening += 1
+
+        try:
+            ftp = self.connect()
+
+        except Exception:
+            with self.lock:
+                self.opening -= 1
+                self.lock.notify_all()
+
+                # 其他链接已建立或正在建立时，限制链接数并等待空闲链接
+                if self.pool or self.opening:
+                    self.poolLimit = max(1, len(self.pool) + self.opening)
+
+                while not self.idle and (self.pool or self.opening):
+                    self.lock.wait()
+
+                if self.idle:
+                    return self.idle.pop()
+
+            raise
+
+        with self.lock:
+            self.opening -= 1
+            self.pool.append(ftp)
+            self.lock.notify_all()
+
+        return ftp
+
+
+    def put_ftp(self, ftp, broken=False):
+        """ 归还并行传输FTP链接，状态未知的链接直接关闭
+
+        :参数 ftp: FTP链接
+        :参数 broken: 链接是否出错, 默认: False
+        """
+
+        with self.lock:
+            self.lock.notify_all()
+
+            if not broken:
+                self.idle.append(ftp)
+                return
+
+            self.pool.remove(ftp)
+
+        ftp.close()
+
+
+    def close_pool(self):
+        """ 关闭并行传输使用的FTP链接 """
+
+        with self.lock:
+            pool, self.pool, self.idle = self.pool, [], []
+            self.poolLimit = None
+
+        for ftp in pool:
+            try:
+                ftp.quit()
+            except Exception:
+                ftp.close()
+
+        self.local = local()
 
 
     def __enter__(self):
         return self
 
 
+    def resolve(self, target):
+        """ 将FTP路径转换为绝对路径，相对路径相对于当前FTP工作目录(登陆后即用户主目录)
+
+        :参数 target: FTP路径
+        :返回: 绝对路径
+        """
+
+        if not target.startswith("/"):
+            target = posixpath.join(self.ftp.pwd(), target)
+
+        return posixpath.normpath(target)
+
+
+    def listdir(self, target):
+        """ 列出FTP目录中的资源及其属性，优先使用MLSD，服务器不支持时解析LIST结果，结果在本次操作中缓存
+
+        :参数 target: FTP目录
+        :返回: {名称: {"type": "dir"/"file", "size": 字节数, "modify": "YYYYMMDDHHMMSS"/None}}
+        """
+
+        if target in self.cache:
+            return self.cache[target]
+
+        entries = {}
+
+        if self.mlsd:
+            try:
+                for name, facts in self.ftp.mlsd(target, ["type", "size", "modify"]):
+                    if facts.get("type") in ("cdir", "pdir") or name in (".", ".."):
+                        continue
+
+                    entries[name] = {
+                        "type": "dir" if facts.get("type") == "dir" else "file",
+                        "size": int(facts["size"]) if "size" in facts else None,
+                        "modify": facts.get("modify", "")[:14] or None,
+                    }
+
+            except error_perm as e:
+                if not str(e).startswith(("500", "501", "502")):
+                    raise
+
+                self.mlsd = False
+
+        if not self.mlsd:
+            lines = []
+            self.ftp.retrlines("LIST %s" % target, lines.append)
+
+            for line in lines:
+                parts = line.split(None, 8)
+
+                if len(parts) < 9 or parts[8] in (".", ".."):
+                    continue
+
+                name = parts[8].split(" -> ")[0] if line.startswith("l") else parts[8]
+                entries[name] = {
+                    "type": "dir" if line.startswith("d") else "file",
+                    "size": int(parts[4]) if parts[4].isdigit() else None,
+                    "modify": None,
+                }
+
+        self.cache[target] = entries
+
+        return entries
+
+
+    def stat(self, target):
+        """ 查询FTP资源属性，通过列出上级目录获取
+
+        :参数 target: FTP资源
+        :返回: 资源属性，资源不存在时返回None
+        """
+
+        parent, name = posixpath.split(target.rstrip("/"))
+
+        if not name:
+            return {"type": "dir", "size": None, "modify": None}
+
+        try:
+            return self.listdir(parent or "/").get(name)
+        except error_perm:
+            return None
+
+
+    def walk(self, target):
+        """ 自上而下遍历FTP目录，每个目录只列出一次
+
+        :参数 target: FTP目录
+        :返回: 生成器 (目录路径, 子目录名称列表, {文件名称: 文件属性})
+        """
+
+        entries = self.listdir(target)
+        dirs = sorted( name for name, facts in entries.items() if facts["type"] == "dir" )
+        files = dict( (name, facts) for name, facts in entries.items() if facts["type"] != "dir" )
+
+        yield target, dirs, files
+
+        for name in dirs:
+            for result in self.walk(posixpath.join(target, name)):
+                yield result
+
+
+    def remote_tree(self, target):
+        """ 收集FTP资源下的所有目录与文件
+
+        :参数 target: FTP资源
+        :返回: 目录列表(自上而下), 文件列表 [(FTP路径, 文件属性), ...]，资源不存在时返回None
+        """
+
+        facts = self.stat(target)
+
+        if facts is None:
+            return None
+
+        if facts["type"] != "dir":
+            return [], [(target, facts)]
+
+        dirs, files = [], []
+
+        for dirpath, _, entries in self.walk(target):
+            dirs.append(dirpath)
+            files.extend( (posixpath.join(dirpath, name), entries[name]) for name in sorted(entries) )
+
+        return dirs, files
+
+
+    def local_tree(self, local, target):
+        """ 收集本地资源下的所有目录与文件，并映射为上传后的FTP路径
+
+        :参数 local: 本地资源
+        :参数 target: 上传的FTP目录
+        :返回: FTP目录列表(自上而下), 文件列表 [(本地路径, FTP路径), ...]
+        """
+
+        local = os.path.abspath(local)
+        base = os.path.dirname(local)
+        dirs, files = [target], []
+
+        if os.path.isdir(local):
+            for root, subdirs, names in os.walk(local):
+                subdirs.sort()
+                remote = posixpath.join(target, *os.path.relpath(root, base).split(os.sep))
+                dirs.append(remote)
+                files.extend( (os.path.join(root, name), posixpath.join(remote, name)) for name in sorted(names) )
+        else:
+            files.append( (local, posixpath.join(target, os.path.basename(local))) )
+
+        return dirs, files
+
+
+    def make_dirs(self, dirs):
+        """ 按顺序创建不存在的FTP目录(包括上级目录)，并更新目录缓存
+
+        :参数 dirs: FTP目录列表(自上而下)
+        """
+
+        for path in dirs:
+            facts = self.stat(path)
+
+            if facts is None:
+                parent, name = posixpath.split(path.rstrip("/"))
+                self.make_dirs([parent or "/"])
+                self.ftp.mkd(path)
+                self.listdir(parent or "/")[name] = {"type": "dir", "size": None, "modify": None}
+                self.cache[path] = {}
+
+            elif facts["type"] != "dir":
+                raise IOError("FTP中已存在同名文件: %s" % path)
+
+
     def check_dir(self, target):
-        """ 切换FTP指定目录判断目录是否存在
+        """ 判断FTP指定目录是否存在
  
         :参数 target: 指定FTP目录
         :返回: True/False
         """
  
-        try:
-            curr = self.ftp.pwd()
-            self.ftp.cwd(target)
-            self.ftp.cwd(curr)
-            return True
-        except:
-            return False
+        self.cache = {}
+        facts = self.stat(self.resolve(target))
+
+        return facts is not None and facts["type"] == "dir"
 
 
     def ftp_list(self, target=None):
@@ -51,46 +330,409 @@ class FtpClient(object):
         :显示: 目录中的资源
         """
 
-        self.ftp.dir(target)
+        self.cache = {}
+        target = self.resolve(target or "")
+        facts = self.stat(target)
+
+        if facts is None:
+            return
+
+        entries = self.listdir(target) if facts["type"] == "dir" else {posixpath.basename(target): facts}
+
+        for name in sorted(entries):
+            facts = entries[name]
+            print("%-4s %12s %14s %s" % (facts["type"], facts["size"] or "-", facts["modify"] or "-", name))
+
+
+    def get_buffer(self):
+        """ 获取当前线程复用的收发缓冲区
+
+        :返回: memoryview
+        """
+
+        buf = getattr(self.local, "buffer", None)
+
+        if buf is None:
+            buf = self.local.buffer = memoryview(bytearray(self.blockBytes))
+
+        return buf
+
+
+    def open_data(self, ftp, cmd, rest=None):
+        """ 以二进制模式建立数据链接并按配置设置socket缓冲区
+
+        :参数 ftp: FTP链接
+        :参数 cmd: 传输命令
+        :参数 rest: REST偏移位置, 默认: None
+        :返回: 数据链接socket
+        """
+
+        ftp.voidcmd("TYPE I")
+        conn = ftp.transfercmd(cmd, rest)
+
+        if self.sockBufBytes:
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.sockBufBytes)
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sockBufBytes)
+
+        return conn
+
+
+    def retr_range(self, ftp, path, fd, rest=0, length=None):
+        """ 从指定偏移位置下载FTP文件，数据直接接收到复用的缓冲区并写入本地文件的当前位置
+
+        :参数 ftp: FTP链接
+        :参数 path: FTP文件
+        :参数 fd: 本地文件对象(建议使用无缓冲模式打开)
+        :参数 rest: 下载的起始偏移位置, 默认: 0
+        :参数 length: 下载的字节数, 读取到该长度后关闭数据链接, 默认: None (下载到文件结尾)
+        """
+
+        buf = self.get_buffer()
+        conn = self.open_data(ftp, "RETR %s" % path, rest or None)
+        remaining = length
+
+        try:
+            while remaining is None or remaining > 0:
+                size = conn.recv_into(buf, len(buf) if remaining is None else min(len(buf), remaining))
+
+                if not size:
+                    break
+
+                fd.write(buf[:size])
+
+                if remaining is not None:
+                    remaining -= size
+        finally:
+            conn.close()
+
+        # 提前关闭数据链接时服务器可能返回 426/451
+        try:
+            ftp.voidresp()
+        except (error_perm, error_temp):
+            if length is None or remaining:
+                raise
+
+        if remaining:
+            raise IOError("下载数据不完整: %s (缺少 %s 字节)" % (path, remaining))
+
+
+    def stor_file(self, ftp, path, filename):
+        """ 上传本地文件，数据直接读取到复用的缓冲区后发送
+
+        :参数 ftp: FTP链接
+        :参数 path: FTP文件
+        :参数 filename: 本地文件
+        """
+
+        buf = self.get_buffer()
+
+        with open(filename, "rb", 0) as fd:
+            conn = self.open_data(ftp, "STOR %s" % path)
+
+            try:
+                while True:
+                    size = fd.readinto(buf)
+
+                    if not size:
+                        break
+
+                    conn.sendall(buf[:size])
+            finally:
+                conn.close()
+
+        ftp.voidresp()
+
+
+    def get_file(self, ftp, path, filename, size=None, resume=False):
+        """ 下载单个FTP文件，断点续传时从本地文件已有的长度继续下载
+
+        :参数 ftp: FTP链接
+        :参数 path: FTP文件
+        :参数 filename: 本地文件
+        :参数 size: FTP文件大小, 默认: None (未知)
+        :参数 resume: 是否断点续传, 默认: False
+        """
+
+        offset = os.path.getsize(filename) if resume and os.path.isfile(filename) else 0
+
+        if size is not None and offset > size:
+            offset = 0
+
+        if size is not None and offset == size and offset:
+            return
+
+        with open(filename, "r+b" if offset else "wb", 0) as fd:
+            fd.seek(offset)
+            self.retr_range(ftp, path, fd, offset)
+
 
+    def load_manifest(self, manifest, size, modify):
+        """ 读取分段下载的进度记录文件，FTP文件的大小或修改时间与记录不一致时丢弃已有进度
 
-    def ftp_get(self, target, local=None):
+        :参数 manifest: 进度记录文件
+        :参数 size: FTP文件大小
+        :参数 modify: FTP文件修改时间
+        :返回: 已下载完成的字节范围列表 [[start, end), ...]
+        """
+
+        try:
+            with open(manifest) as fd:
+                record = json.load(fd)
+        except (IOError, OSError, ValueError):
+            return []
+
+        if (record.get("size"), record.get("modify")) != (size, modify):
+            return []
+
+        return [ list(r) for r in record.get("done", []) ]
+
+
+    def save_manifest(self, manifest, size, modify, done):
+        """ 将已下载完成的字节范围写入进度记录文件，先写临时文件再替换，中断时不会留下不完整的记录
+
+        :参数 manifest: 进度记录文件
+        :参数 size: FTP文件大小
+        :参数 modify: FTP文件修改时间
+        :参数 done: 已下载完成的字节范围列表 [[start, end), ...]
+        """
+
+        tmp = manifest + ".tmp"
+
+        with open(tmp, "w") as fd:
+            json.dump({"size": size, "modify": modify, "done": done}, fd)
+
+        getattr(os, "replace", os.rename)(tmp, manifest)
+
+
+    def ftp_get_file(self, target, local=None, segments=4, resume=False):
+        """ 使用多个FTP链接分段下载单个大文件，每个链接从不同的REST偏移位置下载到预分配的本地文件中
+
+        下载过程中写入 <文件名>.part，并在 <文件名>.manifest 中记录已下载完成的字节范围，完成后重命名并删除记录；
+        断点续传时只下载记录中缺失的部分，没有 .part 文件时从已有的本地文件长度继续分段下载
+
+        :参数 target: FTP文件
+        :参数 local: 下载到本地路径, 默认: None (当前目录)
+        :参数 segments: 分段数(并发链接数), 每段至少1MB, 默认: 4
+        :参数 resume: 是否断点续传, 默认: False
+        :返回: True/False
+        """
+
+        self.cache = {}
+        target = self.resolve(target.strip("/"))
+        local = local or os.path.abspath(os.path.curdir)
+        facts = self.stat(target)
+
+        if not os.path.isdir(local) or facts is None or facts["type"] == "dir":
+            return False
+
+        size = facts["size"] if facts["size"] is not None else self.ftp.size(target)
+        modify = facts["modify"]
+        filename = os.path.join(local, posixpath.basename(target))
+        part = filename + ".part"
+        manifest = filename + ".manifest"
+        done = []
+
+        if resume and os.path.isfile(part):
+            if os.path.getsize(part) == size:
+                done = self.load_manifest(manifest, size, modify)
+
+        elif resume and os.path.isfile(filename):
+            offset = min(os.path.getsize(filename), size)
+
+            # 本地文件已完整，无需下载
+            if offset == size:
+                return True
+
+            os.rename(filename, part)
+            done = [[0, offset]] if offset else []
+
+        with open(part, "r+b" if done else "wb") as fd:
+            fd.truncate(size)
+
+        # 重新下载时覆盖旧的进度记录
+        self.save_manifest(manifest, size, modify, done)
+
+        # 已完成范围之间的缺失部分
+        missing, position = [], 0
+
+        for start, end in sorted(done) + [[size, size]]:
+            if start > position:
+                missing.append((position, start))
+
+            position = max(position, end)
+
+        total = sum( end - start for start, end in missing )
+        segments = max(1, min(segments, total // (1024 * 1024)))
+        step = max(1, -(-total // segments))
+        ranges = [ (start, min(start + step, end)) for begin, end in missing for start in range(begin, end, step) ]
+        lock = Lock()
+
+        def get(ftp, start, end):
+            with open(part, "r+b", 0) as fd:
+                fd.seek(start)
+
+                try:
+                    self.retr_range(ftp, target, fd, start, end - start)
+
+                finally:
+                    # 中断时也记录已写入的部分，下次只下载剩余的字节
+                    if fd.tell() > start:
+                        with lock:
+                            done.append([start, fd.tell()])
+                            self.save_manifest(manifest, size, modify, done)
+
+        results = self.transfer([ ("%s:%s-%s" % (target, start, end), get, start, end) for start, end in ranges ], len(ranges))
+
+        if any(results.values()):
+            return False
+
+        getattr(os, "replace", os.rename)(part, filename)
+
+        if os.path.isfile(manifest):
+            os.remove(manifest)
+
+        return True
+
+
+    def ftp_get(self, target, local=None, resume=False):
         """ 递归下载FTP指定目录中的所有资源
 
         :参数 target: FTP中的资源
         :参数 local: 下载到本地路径, 默认: None (当前目录)
+        :参数 resume: 是否断点续传, 本地已存在的文件从已有长度继续下载, 默认: False
         :返回: True/False
         """
 
-        target = target.strip("/")
+        self.cache = {}
+        target = self.resolve(target.strip("/"))
         local = local or os.path.abspath(os.path.curdir)
 
         if not os.path.isdir(local):
             return False
 
-        if self.check_dir(target + "/"):
-            local = os.path.join(local, os.path.basename(target))
+        tree = self.remote_tree(target)
 
-            if not os.path.isdir(local):
-                os.makedirs(local)
+        if tree is None:
+            return False
 
-            self.ftp.cwd(target)
+        dirs, files = tree
+        base = posixpath.dirname(target)
 
-            for res in self.ftp.nlst():
-                self.ftp_get(target=res, local=local)
+        for path in dirs:
+            path = os.path.join(local, *posixpath.relpath(path, base).split("/"))
 
-            self.ftp.cwd("..")
+            if not os.path.isdir(path):
+                os.makedirs(path)
 
-        elif self.ftp.nlst(target):
-            with open(os.path.join(local, os.path.basename(target)), "wb") as fd:
-                self.ftp.retrbinary("RETR %s" % target, fd.write, 4096)
-        
-        else:
-            return False
+        for path, facts in files:
+            filename = os.path.join(local, *posixpath.relpath(path, base).split("/"))
+            self.get_file(self.ftp, path, filename, facts["size"], resume)
                 
         return True
 
 
+    def transfer(self, jobs, workers, keep=False):
+        """ 使用多个FTP链接并发执行传输任务
+
+        :参数 jobs: 传输任务列表 [(FTP路径, 传输函数, 参数...), ...]，传输函数的第一个参数为FTP链接
+        :参数 workers: 并发链接数，不大于1时使用当前链接顺序执行
+        :参数 keep: 是否保留并行链接供后续的 transfer 复用，调用方需在完成后执行 close_pool, 默认: False
+        :返回: 每个FTP路径的传输结果 {FTP路径: None (成功) / 错误信息}
+        """
+
+        def run(job, parallel=True):
+            path, func, args = job[0], job[1], job[2:]
+
+            # 无法建立链接时记录为该路径的错误
+            try:
+                ftp = self.get_ftp() if parallel else self.ftp
+            except Exception as e:
+                return path, str(e) or e.__class__.__name__
+
+            try:
+                func(ftp, *args)
+
+            except Exception as e:
+                # 出错的并行链接状态未知，丢弃后由下一个任务重新建立
+                if parallel:
+                    self.put_ftp(ftp, broken=True)
+
+                return path, str(e) or e.__class__.__name__
+
+            if parallel:
+                self.put_ftp(ftp)
+
+            return path, None
+
+        if workers <= 1:
+            return dict( run(job, False) for job in jobs )
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                return dict(executor.map(run, jobs))
+        finally:
+            if not keep:
+                self.close_pool()
+
+
+    def parallel_get(self, target, local=None, workers=4, resume=False):
+        """ 使用多个FTP链接并行递归下载FTP指定目录中的所有资源
+
+        :参数 target: FTP中的资源
+        :参数 local: 下载到本地路径, 默认: None (当前目录)
+        :参数 workers: 并发链接数, 默认: 4
+        :参数 resume: 是否断点续传, 默认: False
+        :返回: 每个文件的下载结果 {FTP路径: None (成功) / 错误信息}，资源不存在时返回None
+        """
+
+        self.cache = {}
+        target = self.resolve(target.strip("/"))
+        local = local or os.path.abspath(os.path.curdir)
+
+        if not os.path.isdir(local):
+            return None
+
+        tree = self.remote_tree(target)
+
+        if tree is None:
+            return None
+
+        dirs, files = tree
+        base = posixpath.dirname(target)
+        localpath = lambda path: os.path.join(local, *posixpath.relpath(path, base).split("/"))
+
+        for path in dirs:
+            if not os.path.isdir(localpath(path)):
+                os.makedirs(localpath(path))
+
+        jobs = [ (path, self.get_file, path, localpath(path), facts["size"], resume) for path, facts in files ]
+
+        return self.transfer(jobs, workers)
+
+
+    def parallel_put(self, local, target=None, workers=4):
+        """ 使用多个FTP链接并行递归上传本地指定资源到FTP中
+
+        :参数 local: 本地资源
+        :参数 target: 上传的FTP位置, 默认: None (FTP根目录)
+        :参数 workers: 并发链接数, 默认: 4
+        :返回: 每个文件的上传结果 {FTP路径: None (成功) / 错误信息}，本地资源不存在时返回None
+        """
+
+        self.cache = {}
+        target = self.resolve(target or "/")
+
+        if not os.path.exists(local):
+            return None
+
+        dirs, files = self.local_tree(local, target)
+        self.make_dirs(dirs)
+
+        jobs = [ (path, self.stor_file, path, filename) for filename, path in files ]
+
+        return self.transfer(jobs, workers)
+
+
     def ftp_put(self, local, target=None):
         """ 递归上传本地指定资源到FTP中
 
@@ -99,30 +741,69 @@ class FtpClient(object):
         :返回: True/False
         """
 
-        target = target or "/"
+        self.cache = {}
+        target = self.resolve(target or "/")
 
         if not os.path.exists(local):
             return False
 
-        if not self.check_dir(target):
-            self.ftp.mkd(target)
+        dirs, files = self.local_tree(local, target)
+        self.make_dirs(dirs)
 
-        if os.path.isdir(local):
-            basedir = os.path.dirname(local)
-            target = os.path.join(target, os.path.basename(local))
+        for filename, path in files:
+            self.stor_file(self.ftp, path, filename)
+                
+        return True
 
-            for res in os.listdir(local):
-                local = os.path.join(os.path.join(basedir, os.path.basename(target)), res)
-                self.ftp_put(local=local, target=target)
 
-        else:
-            res = os.path.basename(local)
+    def bulk_delete(self, target, workers=4):
+        """ 批量递归删除FTP指定资源，一次收集整个目录树，并发删除文件后按深度从深到浅删除目录
 
-            with open(local, "rb") as fd:
-                self.ftp.cwd(target)
-                self.ftp.storbinary("STOR %s" % res, fd, 4096)
-                
-        return True
+        :参数 target: 删除的FTP资源位置
+        :参数 workers: 并发链接数, 默认: 4
+        :返回: 每个文件和目录的删除结果 {FTP路径: None (成功) / 错误信息}，资源不存在时返回None
+        """
+
+        self.cache = {}
+        target = self.resolve(target)
+        tree = self.remote_tree(target)
+
+        if tree is None:
+            return None
+
+        dirs, files = tree
+        levels = {}
+
+        for path in dirs:
+            levels.setdefault(path.rstrip("/").count("/"), []).append(path)
+
+        # 文件与各层目录的删除复用同一组并行链接
+        try:
+            results = self.transfer([ (path, lambda ftp, path: ftp.delete(path), path) for path, _ in files ], workers, keep=True)
+            failed = [ path for path, error in results.items() if error ]
+
+            # 同一深度的目录互不包含，可以并发删除；子资源删除失败的目录直接跳过
+            for depth in sorted(levels, reverse=True):
+                jobs = []
+
+                for path in levels[depth]:
+                    prefix = path.rstrip("/") + "/"
+                    child = next(( p for p in failed if p.startswith(prefix) ), None)
+
+                    if child:
+                        results[path] = "子资源删除失败: %s" % child
+                        failed.append(path)
+                    else:
+                        jobs.append( (path, lambda ftp, path: ftp.rmd(path), path) )
+
+                level = self.transfer(jobs, workers, keep=True)
+                results.update(level)
+                failed.extend( path for path, error in level.items() if error )
+
+        finally:
+            self.close_pool()
+
+        return results
 
 
     def ftp_delete(self, target):
@@ -132,31 +813,148 @@ class FtpClient(object):
         :返回: True/False
         """
 
-        if not self.ftp.nlst(target):
-            return False
+        results = self.bulk_delete(target, workers=1)
 
-        def _delete(target):
-            if self.check_dir(target):
-                resources = self.ftp.nlst(target)
-                
-                if not resources:
-                    self.ftp.rmd(target)
-    
+        return results is not None and not any(results.values())
+
+
+    def mtime(self, path, facts):
+        """ 查询FTP文件的修改时间，LIST结果中没有精确时间时使用MDTM查询
+
+        :参数 path: FTP文件
+        :参数 facts: 文件属性
+        :返回: UTC时间 YYYYMMDDHHMMSS，无法获取时返回None
+        """
+
+        if not facts["modify"]:
+            try:
+                facts["modify"] = self.ftp.sendcmd("MDTM %s" % path).split()[-1][:14]
+            except error_perm:
+                return None
+
+        return facts["modify"]
+
+
+    def ftp_sync(self, local, target, direction="get", prune=False, dryRun=False, workers=1):
+        """ 增量同步本地目录与FTP目录的内容，只传输新增或大小、修改时间有变化的文件
+
+        源文件大小不同或修改时间晚于目标文件时传输，传输后将目标文件的修改时间设置为与源文件一致
+
+        :参数 local: 本地目录
+        :参数 target: FTP目录
+        :参数 direction: 同步方向 get (FTP -> 本地) / put (本地 -> FTP), 默认: get
+        :参数 prune: 是否删除目标目录中源目录没有的文件和目录, 默认: False
+        :参数 dryRun: 只统计需要传输和删除的文件，不执行操作, 默认: False
+        :参数 workers: 并发链接数, 默认: 1 (单链接顺序传输)
+        :返回: {"transfer": [相对路径], "delete": [相对路径], "skip": 未变化的文件数, "errors": {相对路径: 错误信息}}，源目录不存在时返回None
+        """
+
+        self.cache = {}
+        target = self.resolve(target)
+        local = os.path.abspath(local)
+
+        remoteFiles, remoteDirs = {}, []
+        localFiles, localDirs = {}, []
+        tree = self.remote_tree(target)
+
+        if tree is not None:
+            dirs, files = tree
+            remoteDirs = [ posixpath.relpath(path, target) for path in dirs[1:] ]
+            remoteFiles = dict( (posixpath.relpath(path, target), facts) for path, facts in files )
+
+        if os.path.isdir(local):
+            for root, subdirs, names in os.walk(local):
+                rel = os.path.relpath(root, local).replace(os.sep, "/")
+
+                if rel != ".":
+                    localDirs.append(rel)
+
+                for name in names:
+                    path = os.path.join(root, name)
+                    localFiles[posixpath.normpath(posixpath.join(rel, name))] = {
+                        "size": os.path.getsize(path),
+                        "modify": time.strftime("%Y%m%d%H%M%S", time.gmtime(os.path.getmtime(path))),
+                    }
+
+        if direction == "get":
+            if tree is None:
+                return None
+            source, dest, sourceDirs, destDirs = remoteFiles, localFiles, remoteDirs, localDirs
+        else:
+            if not os.path.isdir(local):
+                return None
+            source, dest, sourceDirs, destDirs = localFiles, remoteFiles, localDirs, remoteDirs
+
+        remotePath = lambda rel: posixpath.join(target, rel)
+        localPath = lambda rel: os.path.join(local, *rel.split("/"))
+        report = {"transfer": [], "delete": [], "skip": 0, "errors": {}}
+
+        for rel in sorted(source):
+            facts = dest.get(rel)
+            sourceTime = self.mtime(remotePath(rel), source[rel]) if direction == "get" else source[rel]["modify"]
+            destTime = self.mtime(remotePath(rel), facts) if facts and direction == "put" else facts and facts["modify"]
+
+            if facts and facts["size"] == source[rel]["size"] and sourceTime and destTime and sourceTime <= destTime:
+                report["skip"] += 1
+            else:
+                report["transfer"].append(rel)
+
+        if prune:
+            extraDirs = [ rel for rel in destDirs if rel not in set(sourceDirs) ]
+            report["delete"] = sorted( rel for rel in dest if rel not in source ) + \
+                sorted(extraDirs, key=lambda rel: rel.count("/"), reverse=True)
+
+        if dryRun:
+            return report
+
+        if direction == "get":
+            # 首次同步时本地目录可能不存在
+            for rel in ["."] + sourceDirs:
+                if not os.path.isdir(localPath(rel)):
+                    os.makedirs(localPath(rel))
+
+            def sync(ftp, rel):
+                self.get_file(ftp, remotePath(rel), localPath(rel))
+
+                if source[rel]["modify"]:
+                    mtime = calendar.timegm(time.strptime(source[rel]["modify"], "%Y%m%d%H%M%S"))
+                    os.utime(localPath(rel), (mtime, mtime))
+
+            def remove(ftp, rel):
+                if os.path.isdir(localPath(rel)):
+                    os.rmdir(localPath(rel))
                 else:
-                    for res in resources:
-                        target = os.path.join(target, res)
-                        _delete(target=target)
-    
-                    if self.check_dir(target):
-                        self.ftp.rmd(target)
-    
-            elif self.ftp.nlst(target):
-                self.ftp.delete(target)
+                    os.remove(localPath(rel))
 
-        _delete(target)
-        self.ftp.rmd(target)
+        else:
+            self.make_dirs([target] + [ remotePath(rel) for rel in sourceDirs ])
 
-        return True
+            def sync(ftp, rel):
+                self.stor_file(ftp, remotePath(rel), localPath(rel))
+
+                # 服务器不支持 MFMT 时远程修改时间为上传时间，同样晚于本地文件
+                try:
+                    ftp.sendcmd("MFMT %s %s" % (source[rel]["modify"], remotePath(rel)))
+                except error_perm:
+                    pass
+
+            def remove(ftp, rel):
+                if rel in dest:
+                    ftp.delete(remotePath(rel))
+                else:
+                    ftp.rmd(remotePath(rel))
+
+        files = [ rel for rel in report["delete"] if rel in dest ]
+
+        try:
+            results = self.transfer([ (rel, sync, rel) for rel in report["transfer"] ], workers, keep=True)
+            results.update(self.transfer([ (rel, remove, rel) for rel in files ], workers, keep=True))
+            results.update(self.transfer([ (rel, remove, rel) for rel in report["delete"] if rel not in dest ], 1))
+        finally:
+            self.close_pool()
+        report["errors"] = dict( (rel, error) for rel, error in results.items() if error )
+
+        return report
 
 
     def __exit__(self, type, value, traceback):
@@ -181,14 +979,37 @@ if __name__ == "__main__":
         --delete  <FTP 文件/目录>
         删除FTP中的文件或整个目录
 
+        --sync-get  <FTP 目录>  <本地目录>
+        增量同步FTP目录内容到本地目录, 只下载新增或有变化的文件
+
+        --sync-put  <本地目录>  <FTP 目录>
+        增量同步本地目录内容到FTP目录, 只上传新增或有变化的文件
+
+        --prune
+        同步时删除目标目录中多余的文件和目录
+
+        --resume
+        --get 时断点续传, 本地已存在的文件从已有长度继续下载
+
+        --segments <分段数>
+        --get 单个大文件时使用多个FTP链接分段并行下载
 
-        {} -s <服务器地址> -o <服务器端口> -u <用户名> -p <密码>  --list | ....
+        --dry-run
+        同步时只列出需要传输和删除的文件, 不执行操作
+
+        -n        <并发链接数>
+        --get/--put/--delete/--sync-* 时使用多个FTP链接并行传输或删除, 默认: 1 (单链接顺序执行)
+
+
+        {} -s <服务器地址> -o <服务器端口> -u <用户名> -p <密码> [-n <并发链接数>]  --list | ....
     """
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hs:o:u:p:", ["help", "list", "put=", "get=", "delete="])
-        server, port, username, password = [None] * 4
-        cmd = {"func": None, "target": None, "local": None}
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "hs:o:u:p:n:", ["help", "list", "put=", "get=", "delete=",
+                                                                "sync-get=", "sync-put=", "prune", "dry-run", "resume", "segments="])
+        server, username, password = [None] * 3
+        port, workers = 21, 1
+        cmd = {"func": None, "target": None, "local": None, "prune": False, "dryRun": False, "resume": False, "segments": 1}
     
         for name, value in opts:
             if name in ("-h", "--help"):
@@ -207,9 +1028,12 @@ if __name__ == "__main__":
             elif name == "-p":
                 password = value
 
+            elif name == "-n":
+                workers = int(value)
+
             elif name == "--list":
                 cmd["func"] = "list"
-                cmd["target"] = value
+                cmd["target"] = len(args) and args[0] or None
 
             elif name == "--get":
                 cmd["func"] = "get"
@@ -225,19 +1049,67 @@ if __name__ == "__main__":
                 cmd["func"] = "delete"
                 cmd["target"] = value
 
+            elif name == "--sync-get":
+                cmd["func"] = "sync-get"
+                cmd["target"] = value
+                cmd["local"] = args[0]
+
+            elif name == "--sync-put":
+                cmd["func"] = "sync-put"
+                cmd["target"] = args[0]
+                cmd["local"] = value
+
+            elif name == "--prune":
+                cmd["prune"] = True
+
+            elif name == "--dry-run":
+                cmd["dryRun"] = True
+
+            elif name == "--resume":
+                cmd["resume"] = True
+
+            elif name == "--segments":
+                cmd["segments"] = int(value)
+
         if not server or not username or not password:
             raise ValueError 
 
     except:
         sys.exit(1)
 
+    def report(results, action):
+        """ 输出并行传输结果 """
+
+        if results is None:
+            print("%s失败" % action)
+            sys.exit(3)
+
+        failed = dict( (path, error) for path, error in results.items() if error )
+
+        for path in sorted(failed):
+            print("%s失败: %s (%s)" % (action, path, failed[path]))
+
+        print("%s成功: %s, 失败: %s" % (action, len(results) - len(failed), len(failed)))
+
     try:
         with FtpClient(server=server, port=port, username=username, password=password) as client:
             if cmd["func"] == "list":
                 client.ftp_list(target=cmd["target"])
     
+            elif cmd["func"] == "get" and cmd["segments"] > 1:
+                if client.ftp_get_file(target=cmd["target"], local=cmd["local"], segments=cmd["segments"], resume=cmd["resume"]):
+                    print("下载成功")
+                else:
+                    print("下载失败")
+
+            elif cmd["func"] == "get" and workers > 1:
+                report(client.parallel_get(target=cmd["target"], local=cmd["local"], workers=workers, resume=cmd["resume"]), "下载")
+
+            elif cmd["func"] == "put" and workers > 1:
+                report(client.parallel_put(local=cmd["local"], target=cmd["target"], workers=workers), "上传")
+
             elif cmd["func"] == "get":
-                if client.ftp_get(target=cmd["target"], local=cmd["local"]):
+                if client.ftp_get(target=cmd["target"], local=cmd["local"], resume=cmd["resume"]):
                     print("下载成功")
                 else:
                     print("下载失败")
@@ -248,11 +1120,31 @@ if __name__ == "__main__":
                 else:
                     print("上传失败")
     
+            elif cmd["func"] == "delete" and workers > 1:
+                report(client.bulk_delete(target=cmd["target"], workers=workers), "删除")
+
             elif cmd["func"] == "delete":
                 if client.ftp_delete(target=cmd["target"]):
                     print("删除成功")
                 else:
                     print("删除失败")
+
+            elif cmd["func"] in ("sync-get", "sync-put"):
+                result = client.ftp_sync(local=cmd["local"], target=cmd["target"], direction=cmd["func"][5:],
+                                         prune=cmd["prune"], dryRun=cmd["dryRun"], workers=workers)
+
+                if result is None:
+                    print("同步失败")
+                    sys.exit(3)
+
+                for rel in result["transfer"]:
+                    print("传输: %s %s" % (rel, result["errors"].get(rel, "")))
+
+                for rel in result["delete"]:
+                    print("删除: %s %s" % (rel, result["errors"].get(rel, "")))
+
+                print("传输: %s, 删除: %s, 未变化: %s, 失败: %s" % (
+                    len(result["transfer"]), len(result["delete"]), result["skip"], len(result["errors"])))
     
     except Exception as e:
         print(e)
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import ftplib
+import getopt
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.servers import ThreadedFTPServer
+
+from ftp_client import FtpClient
+
+
+class LatencyHandler(FTPHandler):
+    """ 每条命令处理前等待指定时间，模拟控制链接的网络往返延迟 """
+
+    latency = 0
+
+    def pre_process_command(self, line, cmd, arg):
+        if self.latency:
+            time.sleep(self.latency)
+
+        FTPHandler.pre_process_command(self, line, cmd, arg)
+
+
+class CommandCounter(object):
+    """ 统计所有FTP链接发送的命令数(即控制链接往返次数) """
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+        self.putcmd = ftplib.FTP.putcmd
+
+
+    def __enter__(self):
+        counter = self
+
+        def putcmd(ftp, line):
+            with counter.lock:
+                counter.count += 1
+
+            counter.putcmd(ftp, line)
+
+        ftplib.FTP.putcmd = putcmd
+
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        ftplib.FTP.putcmd = self.putcmd
+
+
+def start_server(root, latency=0):
+    """ 启动本地FTP服务
+
+    :参数 root: FTP根目录
+    :参数 latency: 每条命令的注入延迟秒数, 默认: 0
+    :返回: FTP服务, 端口
+    """
+
+    # 预先配置日志，避免 pyftpdlib 输出每条命令的INFO日志
+    logger = logging.getLogger("pyftpdlib")
+    logger.addHandler(logging.NullHandler())
+    logger.setLevel(logging.WARNING)
+
+    authorizer = DummyAuthorizer()
+    authorizer.add_user("bench", "bench", root, perm="elradfmwMT")
+
+    handler = type("BenchHandler", (LatencyHandler,), {"authorizer": authorizer, "latency": latency})
+    server = ThreadedFTPServer(("127.0.0.1", 0), handler)
+
+    thread = threading.Thread(target=server.serve_forever, kwargs={"timeout": 0.1})
+    thread.daemon = True
+    thread.start()
+
+    return server, server.address[1]
+
+
+def make_tree(root, profile, files, sizeKB):
+    """ 生成测试目录树
+
+    :参数 root: 目录
+    :参数 profile: small (大量小文件, 分布在10个目录) / huge (少量大文件) / deep (每层一个文件的深层嵌套目录)
+    :参数 files: 文件数量
+    :参数 sizeKB: 单个文件大小(KB)
+    :返回: 文件数量, 总字节数
+    """
+
+    data = os.urandom(sizeKB * 1024)
+
+    for i in range(files):
+        if profile == "small":
+            path = os.path.join(root, "d%02d" % (i % 10))
+        elif profile == "deep":
+            path = os.path.join(root, *[ "l%02d" % depth for depth in range(i + 1) ])
+        else:
+            path = root
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        with open(os.path.join(path, "f%05d" % i), "wb") as fd:
+            fd.write(data)
+
+    return files, files * len(data)
+
+
+def measure(func, files, size):
+    """ 执行一次操作并统计耗时、吞吐量与每个文件的命令往返次数
+
+    :参数 func: 操作函数
+    :参数 files: 文件数量
+    :参数 size: 总字节数
+    :返回: {"seconds", "filesPerSecond", "mbps", "rtPerFile", "ok"}
+    """
+
+    with CommandCounter() as counter:
+        began = time.time()
+        result = func()
+        seconds = max(time.time() - began, 0.000001)
+
+    if isinstance(result, dict):
+        ok = not any(result.values())
+    else:
+        ok = result is not False and result is not None
+
+    return {
+        "seconds": seconds,
+        "filesPerSecond": files / seconds,
+        "mbps": size / 1024.0 / 1024 / seconds,
+        "rtPerFile": counter.count / float(max(files, 1)),
+        "ok": ok,
+    }
+
+
+def benchmark(profiles, workersList, files, sizeKB, hugeMB, latency=0, blockKB=256):
+    """ 启动本地FTP服务，对不同目录树与并发链接数测试 list/get/put/delete 的性能
+
+    :参数 profiles: 目录树类型列表 [small, huge, deep]
+    :参数 workersList: 并发链接数列表, 1 为单链接顺序模式
+    :参数 files: small/deep 目录树的文件数量
+    :参数 sizeKB: small/deep 目录树的单个文件大小(KB)
+    :参数 hugeMB: huge 目录树的单个文件大小(MB)
+    :参数 latency: 每条命令的注入延迟秒数, 默认: 0
+    :参数 blockKB: 数据链接收发的数据块大小, 默认: 256KB
+    :返回: 结果列表
+    """
+
+    workdir = tempfile.mkdtemp()
+    serverRoot = os.path.join(workdir, "server")
+    os.makedirs(serverRoot)
+    server, port = start_server(serverRoot, latency)
+    results = []
+
+    print("%-6s %-8s %4s %9s %10s %9s %8s %4s" % ("tree", "op", "n", "seconds", "files/s", "MB/s", "rt/file", "ok"))
+
+    try:
+        for profile in profiles:
+            source = os.path.join(workdir, "source-" + profile, "tree")
+
+            if profile == "huge":
+                count, size = make_tree(source, profile, 2, hugeMB * 1024)
+            elif profile == "deep":
+                count, size = make_tree(source, profile, min(files, 50), sizeKB)
+            else:
+                count, size = make_tree(source, profile, files, sizeKB)
+
+            for workers in workersList:
+                client = FtpClient("127.0.0.1", "bench", "bench", port, blockKB=blockKB)
+                target = "/%s-%s" % (profile, workers)
+                local = tempfile.mkdtemp(dir=workdir)
+                remote = target + "/tree"
+
+                cases = [
+                    ("put", lambda: client.ftp_put(source, target) if workers == 1 else client.parallel_put(source, target, workers)),
+                    ("list", lambda: (setattr(client, "cache", {}), client.remote_tree(remote))[1]),
+                    ("get", lambda: client.ftp_get(remote, local) if workers == 1 else client.parallel_get(remote, local, workers)),
+                ]
+
+                if profile == "huge" and workers > 1:
+                    segLocal = tempfile.mkdtemp(dir=workdir)
+                    cases.append(("get-seg", lambda: all(client.ftp_get_file("%s/f%05d" % (remote, i), segLocal, segments=workers)
+                                                         for i in range(count))))
+
+                cases.append(("delete", lambda: client.ftp_delete(target) if workers == 1 else client.bulk_delete(target, workers)))
+
+                for op, func in cases:
+                    result = measure(func, count, size if op not in ("list", "delete") else 0)
+                    result.update({"profile": profile, "op": op, "workers": workers})
+                    results.append(result)
+
+                    print("%-6s %-8s %4s %9.3f %10.1f %9.1f %8.1f %4s" % (
+                        profile, op, workers, result["seconds"], result["filesPerSecond"],
+                        result["mbps"], result["rtPerFile"], result["ok"] and "ok" or "FAIL"))
+
+                client.ftp.close()
+
+    finally:
+        server.close_all()
+        shutil.rmtree(workdir)
+
+    return results
+
+
+if __name__ == "__main__":
+    message = """
+        [ 帮助 ]
+
+        --profiles  目录树类型列表 small,huge,deep, 默认: small,huge,deep
+        --workers   并发链接数列表, 1 为单链接顺序模式, 默认: 1,4,8
+        --files     small/deep 目录树的文件数量, 默认: 500 (deep 最多使用 50)
+        --size      small/deep 目录树的单个文件大小(KB), 默认: 4
+        --huge      huge 目录树的单个文件大小(MB), 默认: 64
+        --latency   每条命令的注入延迟(毫秒), 默认: 0
+        --block     数据链接收发的数据块大小(KB), 默认: 256
+
+        {} --profiles small --workers 1,8 --latency 5
+    """
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "h", ["help", "profiles=", "workers=", "files=", "size=", "huge=", "latency=", "block="])
+        options = {"profiles": ["small", "huge", "deep"], "workers": [1, 4, 8], "files": 500, "size": 4, "huge": 64, "latency": 0, "block": 256}
+
+        for name, value in opts:
+            if name in ("-h", "--help"):
+                print(message.format(sys.argv[0]))
+                sys.exit(0)
+
+            elif name == "--profiles":
+                options["profiles"] = value.split(",")
+
+            elif name == "--workers":
+                options["workers"] = [ int(x) for x in value.split(",") ]
+
+            else:
+                options[name[2:]] = int(value)
+
+    except getopt.GetoptError:
+        print(message.format(sys.argv[0]))
+        sys.exit(1)
+
+    benchmark(profiles=options["profiles"], workersList=options["workers"], files=options["files"], sizeKB=options["size"],
+              hugeMB=options["huge"], latency=options["latency"] / 1000.0, blockKB=options["block"])
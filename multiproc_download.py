@@ -1,118 +1,650 @@
 # -*-coding:utf-8 -*-
 
+import hashlib
+import json
 import os
 import re
 import requests
 import sys
 import time
-import uuid
 
-from threading import activeCount, Thread
-from Queue import Queue
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from threading import Condition, Lock, current_thread, local
 
 
-class Download(object):
+class DownloadStats(object):
 
-    def __init__(self, url, readMB=1, poolSize=5):
-        """ 初始化批量下载参数 
+    def __init__(self, url, filename, totalBytes):
+        """ 初始化下载统计信息
 
         :参数 url: 下载资源地址
-        :参数 readMB: 分片下载时每个线程读取的数据大小，默认: 1MB
-        :参数 poolSize: 设置分片的线程池大小，防止同时启动过多的分片读取数据损耗系统资源，默认最多可同时运行5个线程
+        :参数 filename: 保存到本地的文件路径
+        :参数 totalBytes: 资源字节数
         """
 
         self.url = url
+        self.filename = filename
+        self.totalBytes = totalBytes
+        self.bytes = 0
+        self.seconds = 0
+        self.bytesPerSecond = 0
+        self.retries = 0
+        self.shards = []
+        self.workers = {}
+        self.mirrors = []
+        self.hexdigest = None
+
+
+    def add_shard(self, record):
+        """ 记录一次分片请求的耗时并累计到所属线程
+
+        :参数 record: 分片请求记录 {"worker", "mirror", "start", "end", "bytes", "connect", "firstByte", "transfer", "error"}
+        """
+
+        self.shards.append(record)
+
+        worker = self.workers.setdefault(record["worker"], {"shards": 0, "bytes": 0, "seconds": 0, "bytesPerSecond": 0})
+        worker["shards"] += 1
+        worker["bytes"] += record["bytes"]
+        worker["seconds"] += record["connect"] + record["firstByte"] + record["transfer"]
+        worker["bytesPerSecond"] = worker["bytes"] / max(worker["seconds"], 0.001)
+
+
+    def __repr__(self):
+        return "<DownloadStats %s %s/%s bytes %.1fs %.0f B/s retries=%s>" % (
+            self.filename, self.bytes, self.totalBytes, self.seconds, self.bytesPerSecond, self.retries)
+
+
+class Download(object):
+
+    def __init__(self, url, readMB=1, poolSize=5, blockKB=64, resume=False, retries=3, timeout=30, shardSeconds=2, filename=None, maxErrors=2, digest=None, algorithm="md5", callback=None):
+        """ 初始化批量下载参数 
+
+        :参数 url: 下载资源地址，也可以是内容相同的多个镜像地址列表，分片将按各镜像实测速率分配
+        :参数 readMB: 分片下载时每个线程首个分片的数据大小，之后按线程实测速率在 readMB/4 ~ readMB*16 之间调整，默认: 1MB
+        :参数 poolSize: 设置分片的线程池大小，每个线程保持一个长连接依次下载分片，默认最多可同时运行5个线程
+        :参数 blockKB: 流式读取与写入文件时每次处理的数据块大小，每个线程只缓存一个数据块，默认: 64KB
+        :参数 resume: 是否开启断点续传，开启后将在目标文件旁记录已下载的字节范围，重新运行时只下载缺失的部分，默认: False
+        :参数 retries: 分片下载失败时从中断位置重试的次数，默认: 3
+        :参数 timeout: 建立连接和读取数据的超时秒数，默认: 30
+        :参数 shardSeconds: 自适应分片的目标下载耗时，分片大小 = 线程速率 * shardSeconds，默认: 2
+        :参数 filename: 保存到本地的文件路径，默认: None (使用Content-Disposition或url中的文件名)
+        :参数 maxErrors: 镜像连续失败(包括读取超时)达到该次数后不再使用，默认: 2
+        :参数 digest: 资源的摘要值(十六进制)，下载时同步计算并校验，默认: None (计算但不校验)
+        :参数 algorithm: 摘要算法 [md5, sha1, sha256 ...]，默认: md5
+        :参数 callback: 下载事件回调函数 callback(event, info)，event为 shard (每次分片请求结束) 或 progress (每秒的整体进度)，默认: None
+        """
+
+        urls = list(url) if isinstance(url, (list, tuple)) else [url]
+
+        self.url = urls[0]
         self.readBytes = readMB * 1024 * 1024
+        self.blockBytes = blockKB * 1024
+        self.minReadBytes = max(self.readBytes // 4, self.blockBytes)
+        self.maxReadBytes = self.readBytes * 16
+        self.shardSeconds = shardSeconds
+        self.poolSize = poolSize
+        self.retries = retries
+        self.timeout = timeout
+        self.maxErrors = maxErrors
         
-        resp = requests.head(url)
+        resp = requests.head(self.url)
         self.totalBytes = int(resp.headers["Content-Length"])
+        self.etag = resp.headers.get("ETag")
+        self.lastModified = resp.headers.get("Last-Modified")
+        self.mirrors = [ self.check_mirror(u) for u in urls ]
+
+        if not filename:
+            try:
+                filename = eval( re.findall("filename=(\S+)", resp.headers["Content-Disposition"])[0] )
+            except:
+                filename = os.path.basename(self.url)
+
+        self.filename = filename
+
+        self.resume = resume
+        self.manifest = self.filename + ".manifest"
+        self.lock = Lock()
+        self.cond = Condition(self.lock)
+        self.done = self.load_manifest() if resume and os.path.isfile(self.filename) else []
+        self.savedAt = 0
+        self.aborted = False
+        self.local = local()
+        self.sessions = []
+        self.digest = digest and digest.lower()
+        self.hasher = hashlib.new(algorithm)
+        self.hashLock = Lock()
+        self.hashed = 0
+        self.hexdigest = None
+        self.callback = callback
+        self.stats = DownloadStats(self.url, self.filename, self.totalBytes)
+
+        # 检测文件是否存在，断点续传时存在有效的进度记录文件则继续下载
+        if os.path.isfile(self.filename) and not (resume and os.path.isfile(self.manifest)):
+            print("文件已存在: %s" % self.filename)
+            sys.exit()
+
+
+    def check_mirror(self, url):
+        """ 检测镜像地址的资源大小与主地址一致，无法访问的镜像标记为不可用
+
+        :参数 url: 镜像地址
+        :返回: 镜像状态 {"url", "bytes", "seconds", "active", "errors", "alive"}
+        """
+
+        alive = True
+
+        if url != self.url:
+            try:
+                size = int(requests.head(url, timeout=self.timeout).headers["Content-Length"])
+            except Exception:
+                alive = False
+            else:
+                if size != self.totalBytes:
+                    raise ValueError("镜像资源大小不一致: %s (%s != %s)" % (url, size, self.totalBytes))
+
+        return {"url": url, "bytes": 0, "seconds": 0, "active": 0, "errors": 0, "alive": alive}
+
+
+    def pick_mirror(self):
+        """ 选择 实测速率/(正在使用的连接数+1) 最大的镜像，尚未测得速率的镜像优先
+
+        :返回: 镜像状态，所有镜像均不可用时返回None
+        """
+
+        def score(mirror):
+            if not mirror["seconds"]:
+                return float("inf")
+
+            return mirror["bytes"] / mirror["seconds"] / (mirror["active"] + 1)
+
+        mirrors = [ m for m in self.mirrors if m["alive"] ]
+
+        if not mirrors:
+            return None
+
+        mirror = max(mirrors, key=score)
+        mirror["active"] += 1
+
+        return mirror
+
+
+    def load_manifest(self):
+        """ 读取断点续传的进度记录文件，资源大小、ETag或Last-Modified与当前不一致时丢弃已有进度
+
+        :返回: 已下载完成的字节范围列表 [[start, end), ...]
+        """
 
         try:
-            self.filename = eval( re.findall("filename=(\S+)", resp.headers["Content-Disposition"])[0] )
-        except:
-            self.filename = os.path.basename(url)
+            with open(self.manifest) as fd:
+                manifest = json.load(fd)
+        except (IOError, OSError, ValueError):
+            return []
 
-        # 检测文件是否存在
-        if os.path.isfile(self.filename):
-            print("文件已存在: %s" % self.filename)
-            sys.exit()
+        if (manifest.get("totalBytes"), manifest.get("etag"), manifest.get("lastModified")) != \
+                (self.totalBytes, self.etag, self.lastModified):
+            return []
+
+        return [ list(r) for r in manifest.get("done", []) ]
 
-        self.tempdir = os.path.join(os.path.dirname(os.path.realpath(__file__)), str(uuid.uuid4()))
-        self.threadPool = Queue(poolSize)
 
-        [ self.threadPool.put(Thread) for _ in range(poolSize) ]
+    def save_manifest(self, interval=0):
+        """ 将已下载完成的字节范围写入进度记录文件
+
+        :参数 interval: 距上次写入不足该秒数时跳过本次写入，默认: 0 (立即写入)
+        """
 
+        if not self.resume or time.time() - self.savedAt < interval:
+            return
 
-    def delete_temp_dir(self):
-        """ 删除分片存储数据的临时目录与目录中的所有数据 """
+        self.savedAt = time.time()
 
-        files = os.listdir(self.tempdir)
+        with self.lock:
+            manifest = {
+                "url": self.url,
+                "totalBytes": self.totalBytes,
+                "etag": self.etag,
+                "lastModified": self.lastModified,
+                "done": [ list(r) for r in self.done ],
+            }
 
-        for file in files:
-            path = os.path.join(self.tempdir, file)
+        tmp = self.manifest + ".tmp"
 
-            if os.path.isfile(path):
-                os.remove(path)
-            elif os.path.isdir(path):
-                delete_user_dir(path)
+        with open(tmp, "w") as fd:
+            json.dump(manifest, fd)
 
-        os.rmdir(self.tempdir)
+        getattr(os, "replace", os.rename)(tmp, self.manifest)
 
 
-    def write_to_file(self, filename, headers=None, useThread=True):
-        """ 下载url数据并保存到指定文件中 
+    def mark_done(self, start, end):
+        """ 合并记录已写入文件的字节范围
 
-        :参数 filename: 将下载的数据保存到该文件中
-        :参数 headers: 发送HTTP请求是附加的header，默认为None(使用默认的header)
-        :参数 useThread: 是否使用线程进行下载，默认为True(开启使用线程下载)
+        :参数 start: 起始字节位置
+        :参数 end: 结束字节位置(不包含)
         """
 
-        resp = requests.get(self.url, headers=headers)
+        with self.lock:
+            merged = []
+
+            for r in sorted(self.done + [[start, end]]):
+                if merged and r[0] <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], r[1])
+                else:
+                    merged.append(list(r))
+
+            self.done = merged
+
+
+    def hash_update(self, offset, block, wait=False):
+        """ 按文件顺序计算摘要，数据正好位于已计算位置时直接计算，其余数据在前面的数据完成后从文件中补读计算
+
+        :参数 offset: 数据块在文件中的起始位置
+        :参数 block: 已写入文件的数据块
+        :参数 wait: 其他线程正在计算时是否等待，默认: False (跳过，由正在计算的线程或下载结束时补读)
+        """
+
+        if not self.hashLock.acquire(wait):
+            return
+
+        try:
+            if block and offset == self.hashed:
+                self.hasher.update(block)
+                self.hashed += len(block)
+
+            fd = None
+
+            while True:
+                with self.lock:
+                    contiguous = self.done[0][1] if self.done and self.done[0][0] == 0 else 0
+
+                if contiguous <= self.hashed:
+                    break
+
+                fd = fd or open(self.filename, "rb")
+                fd.seek(self.hashed)
+                data = fd.read(min(self.blockBytes, contiguous - self.hashed))
+                self.hasher.update(data)
+                self.hashed += len(data)
+
+            if fd:
+                fd.close()
+        finally:
+            self.hashLock.release()
+
+
+    def missing_ranges(self):
+        """ 计算尚未下载的字节范围
+
+        :返回: 缺失的字节范围列表 [(start, end), ...]，end为包含的结束字节位置
+        """
+
+        result, offset = [], 0
+
+        for start, end in self.done:
+            if start > offset:
+                result.append((offset, start - 1))
+            offset = max(offset, end)
+
+        if offset < self.totalBytes:
+            result.append((offset, self.totalBytes - 1))
+
+        return result
+
+
+    def allocate(self):
+        """ 按资源大小预分配目标文件，各分片直接写入文件中对应的偏移位置 """
+
+        with open(self.filename, "r+b" if self.done else "wb") as fd:
+            fd.truncate(self.totalBytes)
+
+
+    def get_session(self):
+        """ 获取当前线程的长连接会话，每个线程创建一次并在下载结束后关闭
+
+        :返回: requests.Session
+        """
+
+        session = getattr(self.local, "session", None)
+
+        if session is None:
+            session = self.local.session = requests.Session()
+
+            with self.lock:
+                self.sessions.append(session)
+
+        return session
+
+
+    def shard_size(self, rate):
+        """ 根据线程最近测得的下载速率计算下一个分片的大小
+
+        :参数 rate: 线程最近一个分片的下载速率(字节/秒)，未测得时为None
+        :返回: 分片字节数
+        """
+
+        if not rate:
+            return self.readBytes
+
+        return int(min(max(rate * self.shardSeconds, self.minReadBytes), self.maxReadBytes))
+
+
+    def claim(self, rate=None):
+        """ 领取一个待下载的分片，没有剩余的字节范围时拆分剩余数据最多的分片的后半部分
+
+        :参数 rate: 当前线程的下载速率(字节/秒)
+        :返回: 分片 {"start", "pos", "end", "attempt", "mirror"}，所有分片下载完成或下载终止时返回None
+        """
 
-        with open(filename, "ab") as fd:
-            fd.write(resp.content)
+        with self.cond:
+            while not self.aborted:
+                shard = self.carve(rate)
 
-        if useThread:
-            self.threadPool.put(Thread)
+                if shard:
+                    shard["mirror"] = self.pick_mirror()
+                    self.active.append(shard)
+                    return shard
+
+                if not self.active:
+                    return None
+
+                self.cond.wait(0.5)
+
+
+    def carve(self, rate):
+        """ 从剩余字节范围中切出下一个分片，没有剩余时拆分剩余数据最多的分片，调用时需持有锁
+
+        :参数 rate: 当前线程的下载速率(字节/秒)
+        :返回: 分片，没有可下载的范围时返回None
+        """
+
+        if self.pending:
+            first, last = self.pending[0]
+            end = min(first + self.shard_size(rate) - 1, last)
+
+            if end == last:
+                self.pending.pop(0)
+            else:
+                self.pending[0] = (end + 1, last)
+
+            return {"start": first, "pos": first, "end": end, "attempt": 0}
+
+        victim = max(self.active, key=lambda x: x["end"] - x["pos"]) if self.active else None
+
+        if victim and victim["end"] - victim["pos"] + 1 >= 2 * self.minReadBytes:
+            mid = victim["pos"] + (victim["end"] - victim["pos"] + 1) // 2
+            shard = {"start": mid, "pos": mid, "end": victim["end"], "attempt": 0}
+            victim["end"] = mid - 1
+            return shard
+
+        return None
+
+
+    def release(self, shard, seconds, error=None):
+        """ 归还分片并更新镜像状态，下载失败的剩余字节范围重新加入待下载队列，超过重试次数或没有可用镜像则终止下载
+
+        :参数 shard: 分片
+        :参数 seconds: 本次下载耗时
+        :参数 error: 下载失败时的异常，默认: None (下载成功)
+        """
+
+        with self.cond:
+            self.active.remove(shard)
+
+            mirror = shard["mirror"]
+            mirror["active"] -= 1
+
+            if error is None:
+                mirror["bytes"] += shard["end"] - shard["start"] + 1
+                mirror["seconds"] += seconds
+                mirror["errors"] = 0
+
+            else:
+                mirror["errors"] += 1
+                mirror["alive"] = mirror["errors"] < self.maxErrors
+                shard["attempt"] += 1
+
+                self.stats.retries += 1
+
+                if self.aborted or shard["attempt"] > self.retries or not any(m["alive"] for m in self.mirrors):
+                    self.aborted = True
+                    self.cond.notify_all()
+                    raise error
+
+                self.retrying.append(shard)
+
+            self.cond.notify_all()
+
+
+    def retry(self):
+        """ 等待退避时间后重新选择镜像下载失败分片的剩余字节范围
+
+        :返回: 待重试的分片，没有需要重试的分片时返回False
+        """
+
+        with self.cond:
+            if not self.retrying:
+                return False
+
+            shard = self.retrying.pop(0)
+
+        time.sleep(min(2 ** shard["attempt"], 30))
+
+        with self.cond:
+            if self.aborted:
+                return None
+
+            shard["start"] = shard["pos"]
+            shard["mirror"] = self.pick_mirror()
+            self.active.append(shard)
+
+        return shard
+
+
+    def worker(self):
+        """ 线程池中的长驻线程，持续领取分片下载直到没有剩余数据 """
+
+        rate = None
+
+        while True:
+            shard = self.retry() or self.claim(rate)
+
+            if shard is None:
+                return
+
+            began = time.time()
+            shard["timing"] = {"connect": 0, "firstByte": 0, "bytes": 0}
+            error = None
+
+            try:
+                self.fetch(shard)
+                rate = (shard["end"] - shard["start"] + 1) / max(time.time() - began, 0.001)
+
+            except Exception as e:
+                error = e
+
+            timing = shard["timing"]
+            record = {
+                "worker": current_thread().name,
+                "mirror": shard["mirror"]["url"],
+                "start": shard["start"],
+                "end": shard["end"],
+                "bytes": timing["bytes"],
+                "connect": timing["connect"],
+                "firstByte": timing["firstByte"],
+                "transfer": time.time() - began - timing["connect"] - timing["firstByte"],
+                "error": error,
+            }
+
+            with self.lock:
+                self.stats.add_shard(record)
+
+            self.notify("shard", record)
+            self.release(shard, time.time() - began, error)
+
+
+    def fetch(self, shard):
+        """ 发送一次请求下载分片的剩余字节范围并写入目标文件，分片被拆分后在新的结束位置停止
+
+        :参数 shard: 分片
+        """
+
+        start, end = shard["pos"], shard["end"]
+        ranged = (start, end) != (0, self.totalBytes - 1)
+        headers = { "Range": "bytes=%s-%s" % (start, end) } if ranged else None
+        url = shard["mirror"]["url"]
+        timing = shard["timing"]
+        began = time.time()
+        resp = self.get_session().get(url, headers=headers, stream=True, timeout=self.timeout)
+        timing["connect"] = time.time() - began
+
+        try:
+            resp.raise_for_status()
+
+            if ranged and resp.status_code != 206:
+                raise IOError("服务器不支持分片下载: %s" % url)
+
+            # 不使用缓冲写入，保证记录为已完成的数据已写入文件
+            with open(self.filename, "r+b", 0) as fd:
+                fd.seek(start)
+
+                for block in resp.iter_content(chunk_size=self.blockBytes):
+                    if not timing["firstByte"]:
+                        timing["firstByte"] = time.time() - began - timing["connect"]
+
+                    if self.aborted:
+                        raise IOError("下载已终止: %s" % self.url)
+
+                    # 先预留写入范围，分片同时被拆分时不会写入其他线程的范围
+                    with self.lock:
+                        size = min(len(block), shard["end"] + 1 - shard["pos"])
+                        shard["pos"] += size
+                        self.stats.bytes += size
+
+                    if size < len(block):
+                        block = block[:size]
+
+                    fd.write(block)
+                    self.mark_done(start, start + size)
+                    self.hash_update(start, block)
+                    timing["bytes"] += size
+                    start += size
+
+                    if shard["pos"] > shard["end"]:
+                        break
+        finally:
+            resp.close()
+
+        if start <= shard["end"]:
+            shard["pos"] = start
+            raise IOError("分片数据不完整: bytes=%s-%s" % (start, shard["end"]))
+
+
+    def notify(self, event, info):
+        """ 调用下载事件回调函数
+
+        :参数 event: 事件名称 [shard, progress]
+        :参数 info: 事件信息
+        """
+
+        if self.callback:
+            self.callback(event, info)
+
+
+    def progress(self):
+        """ 统计当前整体下载进度
+
+        :返回: {"bytes", "totalBytes", "seconds", "bytesPerSecond", "pendingBytes", "active", "retrying"}
+        """
+
+        with self.lock:
+            seconds = time.time() - self.began
+
+            return {
+                "bytes": self.stats.bytes,
+                "totalBytes": self.totalBytes,
+                "seconds": seconds,
+                "bytesPerSecond": self.stats.bytes / max(seconds, 0.001),
+                "pendingBytes": sum(last - first + 1 for first, last in self.pending),
+                "active": len(self.active),
+                "retrying": len(self.retrying),
+            }
+
+
+    def run_pool(self, poolSize):
+        """ 启动固定数量的长驻线程下载所有缺失的字节范围，任一分片重试后仍失败将终止下载并抛出异常
+
+        :参数 poolSize: 线程数量
+        """
+
+        self.pending = self.missing_ranges()
+        self.active = []
+        self.retrying = []
+
+        with ThreadPoolExecutor(max_workers=poolSize) as executor:
+            futures = [ executor.submit(self.worker) for _ in range(poolSize) ]
+            pending = futures
+
+            try:
+                while pending:
+                    finished, pending = wait(pending, timeout=1, return_when=FIRST_EXCEPTION)
+                    self.save_manifest(interval=1)
+                    self.notify("progress", self.progress())
+
+                    for future in finished:
+                        future.result()
+
+            except BaseException:
+                with self.cond:
+                    self.aborted = True
+                    self.cond.notify_all()
+
+                raise
 
 
     def get(self):
-        """ 下载资源 """
+        """ 下载资源
+
+        :返回: 下载统计信息 DownloadStats
+        """
 
-        if self.readBytes < self.totalBytes:
-            shards = range(self.totalBytes)
+        self.began = time.time()
+
+        try:
+            self.allocate()
 
-            os.mkdir(self.tempdir)
+            try:
+                self.run_pool(self.poolSize if self.readBytes < self.totalBytes else 1)
 
-            for i in range(0, self.totalBytes, self.readBytes):
-                point = shards[i: i + self.readBytes]
-                headers = { "Range": "bytes=%s-%s" % (point[0], point[-1]) }
-                filename = os.path.join(self.tempdir, str(point[-1]))
+            finally:
+                self.save_manifest()
 
-                thread = self.threadPool.get()
-                t = thread(target=self.write_to_file, args=[filename, headers])
-                t.start()
+                for session in self.sessions:
+                    session.close()
 
-            while activeCount() > 1:
-                time.sleep(1)
+                self.stats.seconds = time.time() - self.began
+                self.stats.bytesPerSecond = self.stats.bytes / max(self.stats.seconds, 0.001)
+                self.stats.mirrors = [ dict(m) for m in self.mirrors ]
 
-            results = sorted(map(int, os.listdir(self.tempdir)))
+            if self.missing_ranges():
+                raise IOError("资源下载不完整: %s" % self.url)
 
-            with open(self.filename, "ab") as wfd:
-                for result in results:
-                    f = os.path.join(self.tempdir, str(result))
+        except BaseException:
+            # 未开启断点续传时删除预分配的不完整文件，避免被误认为已下载完成并阻止重新下载
+            if not self.resume and os.path.isfile(self.filename):
+                os.remove(self.filename)
+            raise
 
-                    with open(f, "rb") as rfd:
-                        content = True
+        self.hash_update(self.totalBytes, None, wait=True)
+        self.hexdigest = self.stats.hexdigest = self.hasher.hexdigest()
 
-                        while content:
-                            content = rfd.read(1024)
-                            wfd.write(content)
+        if os.path.isfile(self.manifest):
+            os.remove(self.manifest)
 
-            self.delete_temp_dir()
+        if self.digest and self.hexdigest != self.digest:
+            os.remove(self.filename)
+            raise IOError("资源摘要校验失败: %s (%s != %s)" % (self.url, self.hexdigest, self.digest))
 
-        else:
-            self.write_to_file(filename=self.filename, useThread=False)
+        return self.stats
 
 
 if __name__ == "__main__":
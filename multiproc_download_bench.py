@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import errno
+import getopt
+import hashlib
+import multiprocessing
+import os
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from multiproc_download import Download
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """ 支持 HEAD、Range 与 Content-Disposition 的本地HTTP服务，可注入请求延迟与单连接带宽限制 """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+
+    def resolve(self):
+        """ 解析请求的资源与字节范围
+
+        :返回: 资源路径, 资源字节数, 起始字节位置, 结束字节位置(包含), 是否为分片请求
+        """
+
+        path = os.path.join(self.server.root, os.path.basename(self.path))
+        size = os.path.getsize(path)
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range") or "")
+
+        if not match:
+            return path, size, 0, size - 1, False
+
+        start = int(match.group(1))
+        end = min(int(match.group(2) or size - 1), size - 1)
+
+        return path, size, start, end, True
+
+
+    def send_headers(self, size, start, end, ranged):
+        """ 发送响应头 """
+
+        time.sleep(self.server.latency)
+
+        self.send_response(206 if ranged else 200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Content-Disposition", 'attachment; filename="%s"' % os.path.basename(self.path))
+
+        if ranged:
+            self.send_header("Content-Range", "bytes %s-%s/%s" % (start, end, size))
+
+        self.end_headers()
+
+
+    def do_HEAD(self):
+        if not os.path.isfile(os.path.join(self.server.root, os.path.basename(self.path))):
+            return self.send_error(404)
+
+        path, size, start, end, ranged = self.resolve()
+        self.send_headers(size, 0, size - 1, False)
+
+
+    def do_GET(self):
+        if not os.path.isfile(os.path.join(self.server.root, os.path.basename(self.path))):
+            return self.send_error(404)
+
+        path, size, start, end, ranged = self.resolve()
+        self.send_headers(size, start, end, ranged)
+
+        blockBytes = 64 * 1024
+        began = time.time()
+        sent = 0
+
+        with open(path, "rb") as fd:
+            fd.seek(start)
+
+            while sent < end - start + 1:
+                data = fd.read(min(blockBytes, end - start + 1 - sent))
+
+                # 分片被其他线程接管后客户端会提前断开连接
+                try:
+                    self.wfile.write(data)
+                except (IOError, OSError):
+                    self.close_connection = True
+                    return
+
+                sent += len(data)
+
+                # 按单连接带宽限制补足发送耗时
+                if self.server.rate:
+                    delay = sent / float(self.server.rate) - (time.time() - began)
+
+                    if delay > 0:
+                        time.sleep(delay)
+
+
+class RangeServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, root, latency=0, rate=0):
+        """ 初始化本地HTTP服务
+
+        :参数 root: 资源目录
+        :参数 latency: 每个请求响应前的延迟秒数，默认: 0
+        :参数 rate: 单连接带宽限制(字节/秒)，默认: 0 (不限制)
+        """
+
+        HTTPServer.__init__(self, ("127.0.0.1", 0), RangeHandler)
+
+        self.root = root
+        self.latency = latency
+        self.rate = rate
+
+
+    def handle_error(self, request, client_address):
+        """ 忽略客户端提前关闭链接(取消分片、超时重试)导致的写入错误，其他错误仍输出异常信息
+
+        :参数 request: 请求的套接字
+        :参数 client_address: 客户端地址
+        """
+
+        error = sys.exc_info()[1]
+
+        if isinstance(error, (IOError, OSError)) and error.errno in (errno.ECONNRESET, errno.EPIPE):
+            return
+
+        HTTPServer.handle_error(self, request, client_address)
+
+
+def make_file(path, sizeMB):
+    """ 生成随机内容的测试资源
+
+    :参数 path: 资源路径
+    :参数 sizeMB: 资源大小(MB)
+    :返回: 资源MD5
+    """
+
+    md5 = hashlib.md5()
+
+    with open(path, "wb") as fd:
+        for _ in range(sizeMB):
+            data = os.urandom(1024 * 1024)
+            md5.update(data)
+            fd.write(data)
+
+    return md5.hexdigest()
+
+
+def disk_usage(path):
+    """ 统计目录实际占用的磁盘空间
+
+    :参数 path: 目录
+    :返回: 占用字节数
+    """
+
+    total = 0
+
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.stat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                pass
+
+    return total
+
+
+def run_case(url, md5, outdir, readMB, poolSize, result):
+    """ 在子进程中执行一次下载，统计耗时、峰值内存与下载目录的峰值磁盘占用
+
+    :参数 url: 资源地址
+    :参数 md5: 资源MD5
+    :参数 outdir: 下载目录
+    :参数 readMB: 分片大小(MB)
+    :参数 poolSize: 线程池大小
+    :参数 result: 返回结果的队列
+    """
+
+    peak = [0]
+    stopped = threading.Event()
+
+    def sample():
+        while not stopped.is_set():
+            peak[0] = max(peak[0], disk_usage(outdir))
+            stopped.wait(0.05)
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+
+    try:
+        began = time.time()
+        stats = Download(url, readMB=readMB, poolSize=poolSize, digest=md5,
+                         filename=os.path.join(outdir, os.path.basename(url))).get()
+        seconds = time.time() - began
+        error = None
+    except Exception as e:
+        stats, seconds, error = None, 0, str(e)
+    finally:
+        stopped.set()
+        sampler.join()
+
+    peak[0] = max(peak[0], disk_usage(outdir))
+
+    # Linux 下 ru_maxrss 单位为KB
+    result.put({
+        "seconds": seconds,
+        "retries": stats.retries if stats else None,
+        "rssMB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        "diskMB": peak[0] / 1024.0 / 1024,
+        "error": error,
+    })
+
+
+def benchmark(sizes, readMBs, poolSizes, latency=0, rate=0, repeat=1):
+    """ 启动本地HTTP服务，遍历 资源大小 x 分片大小 x 线程池大小 执行下载并输出结果
+
+    :参数 sizes: 资源大小列表(MB)
+    :参数 readMBs: 分片大小列表(MB)
+    :参数 poolSizes: 线程池大小列表
+    :参数 latency: 每个请求的注入延迟秒数，默认: 0
+    :参数 rate: 单连接带宽限制(字节/秒)，默认: 0 (不限制)
+    :参数 repeat: 每组参数重复次数，取最快的一次，默认: 1
+    :返回: 结果列表
+    """
+
+    root = tempfile.mkdtemp()
+    server = RangeServer(root, latency=latency, rate=rate)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    ctx = multiprocessing.get_context("spawn") if hasattr(multiprocessing, "get_context") else multiprocessing
+    results = []
+
+    print("%8s %8s %8s %10s %10s %10s %10s %8s" % ("sizeMB", "readMB", "pool", "seconds", "MB/s", "peakRSSMB", "peakDiskMB", "retries"))
+
+    try:
+        for sizeMB in sizes:
+            name = "bench-%sMB.bin" % sizeMB
+            md5 = make_file(os.path.join(root, name), sizeMB)
+            url = "http://127.0.0.1:%s/%s" % (server.server_address[1], name)
+
+            for readMB in readMBs:
+                for poolSize in poolSizes:
+                    best = None
+
+                    for _ in range(repeat):
+                        outdir = tempfile.mkdtemp()
+                        queue = ctx.Queue()
+                        proc = ctx.Process(target=run_case, args=(url, md5, outdir, readMB, poolSize, queue))
+                        proc.start()
+                        result = queue.get()
+                        proc.join()
+                        shutil.rmtree(outdir)
+
+                        if best is None or (not result["error"] and result["seconds"] < best["seconds"]):
+                            best = result
+
+                    best.update({"sizeMB": sizeMB, "readMB": readMB, "poolSize": poolSize})
+                    best["mbps"] = sizeMB / best["seconds"] if best["seconds"] else 0
+                    results.append(best)
+
+                    if best["error"]:
+                        print("%8s %8s %8s  失败: %s" % (sizeMB, readMB, poolSize, best["error"]))
+                    else:
+                        print("%8s %8s %8s %10.2f %10.1f %10.1f %10.1f %8s" % (
+                            sizeMB, readMB, poolSize, best["seconds"], best["mbps"], best["rssMB"], best["diskMB"], best["retries"]))
+
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(root)
+
+    return results
+
+
+if __name__ == "__main__":
+    message = """
+        [ 帮助 ]
+
+        --sizes    资源大小列表(MB), 默认: 16,128
+        --read     分片大小列表(MB), 默认: 1,4
+        --pool     线程池大小列表, 默认: 1,4,8
+        --latency  每个请求的注入延迟(毫秒), 默认: 0
+        --rate     单连接带宽限制(KB/s), 默认: 0 (不限制)
+        --repeat   每组参数重复次数, 默认: 1
+
+        {} --sizes 16,128 --read 1,4 --pool 1,4,8 --latency 20 --rate 2048
+    """
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "h", ["help", "sizes=", "read=", "pool=", "latency=", "rate=", "repeat="])
+        options = {"sizes": [16, 128], "read": [1, 4], "pool": [1, 4, 8], "latency": 0, "rate": 0, "repeat": 1}
+
+        for name, value in opts:
+            if name in ("-h", "--help"):
+                print(message.format(sys.argv[0]))
+                sys.exit(0)
+
+            elif name in ("--sizes", "--read", "--pool"):
+                options[name[2:]] = [ int(x) for x in value.split(",") ]
+
+            else:
+                options[name[2:]] = int(value)
+
+    except getopt.GetoptError:
+        print(message.format(sys.argv[0]))
+        sys.exit(1)
+
+    benchmark(sizes=options["sizes"], readMBs=options["read"], poolSizes=options["pool"],
+              latency=options["latency"] / 1000.0, rate=options["rate"] * 1024, repeat=options["repeat"])
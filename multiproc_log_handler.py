@@ -1,50 +1,154 @@
 # -*- coding:utf-8 -*-
 
 import datetime
+import gzip
 import logging
 import os
 import re
+import shutil
+import socket
+import struct
+import sys
+import threading
+import time
+import traceback
+
+from collections import deque
+
+try:
+    import cPickle as pickle
+except:
+    import pickle
+
+try:
+    import fcntl
+except:
+    fcntl = None
+
+try:
+    import zstandard
+except:
+    zstandard = None
 
 
 class MultiProcLogHandler(logging.FileHandler):
 
-    def __init__(self, logfile, when="D", retain=1):
+    def __init__(self, logfile, when="D", retain=1, background=False, queueSize=0, policy="block",
+                 dropLevel=logging.WARNING, batchSize=256, flushInterval=0.5, maxBytes=0, compress=None):
         """ 初始化多进程日志切换参数设置
 
         :参数 logfile: 指定的日志文件
-        :参数 when: 日志切换周期 [S, M, H, D], 默认: D
-        :参数 retain: 保留日志数量, 默认: 1
+        :参数 when: 日志切换周期 [S, M, H, D, None (仅按大小切换)], 默认: D
+        :参数 retain: 保留日志数量(包括当前写入的日志、按大小切换的分段与压缩后的日志), 默认: 1
+        :参数 background: 是否在后台线程中删除不满足保留条件的日志, 默认: False
+        :参数 queueSize: 异步写入队列长度，大于0时由后台线程批量写入日志，默认: 0 (同步写入)
+        :参数 policy: 队列已满时的处理方式 [block (等待), drop-oldest (丢弃最早的日志), drop-below-level (丢弃低于dropLevel的日志，其余等待)], 默认: block
+        :参数 dropLevel: drop-below-level 方式下不丢弃的最低日志级别, 默认: WARNING
+        :参数 batchSize: 队列中的日志达到该数量时立即写入, 默认: 256
+        :参数 flushInterval: 队列中的日志最长等待写入的秒数, 默认: 0.5
+        :参数 maxBytes: 日志文件达到该大小时切换为 日志文件.序号，可与 when 同时使用, 默认: 0 (不按大小切换)
+        :参数 compress: 在后台线程中压缩已切换的日志 [None, gzip, zstd], 默认: None
         """
 
+        if policy not in ("block", "drop-oldest", "drop-below-level"):
+            raise ValueError("不支持的队列处理方式: %s" % policy)
+
+        if compress not in (None, "gzip", "zstd"):
+            raise ValueError("不支持的压缩方式: %s" % compress)
+
+        if compress == "zstd" and zstandard is None:
+            raise ImportError("zstd 压缩需要安装 zstandard")
+
         patterns = {
-            "S": {"suffix": "%Y-%m-%d_%H-%M-%S", "match": r"^\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}$"},
-            "M": {"suffix": "%Y-%m-%d_%H-%M", "match": r"^\d{4}-\d{2}-\d{2}_\d{2}-\d{2}$"},
-            "H": {"suffix": "%Y-%m-%d_%H", "match": r"^\d{4}-\d{2}-\d{2}_\d{2}$"},
-            "D": {"suffix": "%Y-%m-%d", "match": r"^\d{4}-\d{2}-\d{2}$"},
+            "S": {"suffix": "%Y-%m-%d_%H-%M-%S", "match": r"\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}"},
+            "M": {"suffix": "%Y-%m-%d_%H-%M", "match": r"\d{4}-\d{2}-\d{2}_\d{2}-\d{2}"},
+            "H": {"suffix": "%Y-%m-%d_%H", "match": r"\d{4}-\d{2}-\d{2}_\d{2}"},
+            "D": {"suffix": "%Y-%m-%d", "match": r"\d{4}-\d{2}-\d{2}"},
         }
 
         self.logFile = logfile
-        self.roll = patterns[when.upper()]
-        self.logFileFormat = os.path.join("%s.%s" % (logfile, self.roll["suffix"]))
-        self.logFilePath = datetime.datetime.now().strftime(self.logFileFormat)
+        self.when = when and when.upper()
         self.retain = retain
+        self.background = background
+        self.maxBytes = maxBytes
+        self.compress = compress
+        self.compressDelay = 1
+        self.cleaner = None
+        self.cleanerLock = threading.Lock()
+        self.pending = False
+
+        # 日志文件名: 日志文件.时间[.序号][.gz|.zst]，仅按大小切换时为: 日志文件[.序号[.gz|.zst]]
+        if self.when is None:
+            self.logFileFormat = logfile
+            self.match = re.compile(r"^(?P<time>)(?:(?P<index>\d+)(?:\.gz|\.zst)?)?$")
+        else:
+            self.roll = patterns[self.when]
+            self.logFileFormat = os.path.join("%s.%s" % (logfile, self.roll["suffix"]))
+            self.match = re.compile(r"^(?P<time>%s)(?:\.(?P<index>\d+))?(?:\.gz|\.zst)?$" % self.roll["match"])
+        self.queueSize = queueSize
+        self.policy = policy
+        self.dropLevel = dropLevel
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.dropped = 0
+
+        # 队列长度不大于 batchSize 时，队列满即唤醒写入线程
+        self.wakeSize = max(1, min(batchSize, queueSize))
+        self.writer = None
+
+        now = time.time()
+        self.logFilePath = self.when and datetime.datetime.fromtimestamp(now).strftime(self.logFileFormat) or logfile
+        self.rolloverAt = self.compute_rollover(now)
 
         super(MultiProcLogHandler, self).__init__(self.logFilePath, "a")
 
+        self.delete_logfile()
+
+        if self.queueSize > 0:
+            self.start_writer()
+
+
+    def compute_rollover(self, now):
+        """ 计算下一个日志切换时间点，即当前周期结束的时间
+
+        :参数 now: 当前时间戳
+        :返回: 下一个切换时间点的时间戳
+        """
+
+        if self.when is None:
+            return float("inf")
+
+        current = datetime.datetime.fromtimestamp(now).replace(microsecond=0)
+
+        if self.when == "S":
+            start, step = current, datetime.timedelta(seconds=1)
+        elif self.when == "M":
+            start, step = current.replace(second=0), datetime.timedelta(minutes=1)
+        elif self.when == "H":
+            start, step = current.replace(minute=0, second=0), datetime.timedelta(hours=1)
+        else:
+            start, step = current.replace(hour=0, minute=0, second=0), datetime.timedelta(days=1)
+
+        # 使用本地时间计算，与日志文件名的时间后缀保持一致
+        return time.mktime((start + step).timetuple())
 
-    def check_switch(self):
-        """ 检测当前写入日志是否满足切换条件
 
+    def check_switch(self, now=None):
+        """ 检测当前写入日志是否满足切换条件，未到切换时间点时只做一次比较
+
+        :参数 now: 当前时间戳，默认: time.time()
         :返回: True/False
         """
 
-        currentLogFilePath = datetime.datetime.now().strftime(self.logFileFormat)
+        if now is None:
+            now = time.time()
 
-        if currentLogFilePath == self.logFilePath:
+        if now < self.rolloverAt:
             return False
 
-        self.logFilePath = currentLogFilePath
-        
+        self.logFilePath = datetime.datetime.fromtimestamp(now).strftime(self.logFileFormat)
+        self.rolloverAt = self.compute_rollover(now)
+
         return True
 
 
@@ -61,10 +165,112 @@ class MultiProcLogHandler(logging.FileHandler):
             self.stream = self._open()
 
 
-    def get_logfile_to_delete(self):
-        """ 列出不满足保留条件的日志
-        
-        :返回: 待删除的日志文件列表
+    def lock_file(self):
+        """ 获取多进程切换日志使用的文件锁，关闭返回的锁文件即释放锁
+
+        :返回: 锁文件
+        """
+
+        fd = open(self.logFile + ".lock", "a+")
+
+        if fcntl is not None:
+            fcntl.flock(fd.fileno(), fcntl.LOCK_EX)
+
+        return fd
+
+
+    def rollover(self, now):
+        """ 按时间切换日志，多个进程中只有第一个切换到新周期的进程删除和压缩日志
+
+        :参数 now: 当前时间戳
+        """
+
+        if not self.check_switch(now):
+            return
+
+        self.switch_log()
+
+        # 锁文件中记录最近一次完成清理的周期
+        fd = self.lock_file()
+
+        try:
+            fd.seek(0)
+            last = fd.read().strip()
+
+            if last and float(last) >= self.rolloverAt:
+                return
+
+            fd.truncate(0)
+            fd.write(repr(self.rolloverAt))
+            fd.flush()
+
+        finally:
+            fd.close()
+
+        self.delete_logfile()
+
+
+    def _open(self):
+        """ 打开日志文件并记录其 inode，用于发现其他进程已切换日志 """
+
+        stream = logging.FileHandler._open(self)
+        self.inode = os.fstat(stream.fileno()).st_ino
+
+        return stream
+
+
+    def check_size(self):
+        """ 检测当前日志文件是否达到按大小切换的条件，每次写入前执行
+        其他进程已将日志重命名时(inode 变化)重新打开日志文件，避免写入已切换甚至已压缩删除的文件
+
+        :返回: True/False
+        """
+
+        if self.maxBytes <= 0 or self.stream is None:
+            return False
+
+        try:
+            stat = os.stat(self.baseFilename)
+        except OSError:
+            stat = None
+
+        if stat is None or stat.st_ino != self.inode:
+            self.switch_log()
+            return False
+
+        return stat.st_size >= self.maxBytes
+
+
+    def rotate_size(self):
+        """ 按大小切换日志: 持有文件锁时确认文件未被其他进程切换后重命名为下一个序号，否则仅重新打开日志文件 """
+
+        rotated = False
+        fd = self.lock_file()
+
+        try:
+            try:
+                stat = os.stat(self.baseFilename)
+            except OSError:
+                stat = None
+
+            if stat is not None and stat.st_ino == self.inode and stat.st_size >= self.maxBytes:
+                os.rename(self.baseFilename, "%s.%d" % (self.baseFilename, self.next_index()))
+                rotated = True
+
+            # 已被其他进程切换时 inode 发生变化，重新打开即可
+            self.switch_log()
+
+        finally:
+            fd.close()
+
+        if rotated:
+            self.delete_logfile()
+
+
+    def list_logfile(self):
+        """ 列出所有日志(包括当前写入的日志)，按时间与序号从旧到新排序
+
+        :返回: [(日志文件, 文件名匹配结果), ...]
         """
 
         dirName, _ = os.path.split(self.baseFilename)
@@ -74,12 +280,68 @@ class MultiProcLogHandler(logging.FileHandler):
 
         for logFile in os.listdir(dirName):
             if logFile[:plen] == prefix:
-                suffix = logFile[plen:]
-                
-                if re.compile(self.roll["match"]).match(suffix):
-                    result.append(os.path.join(dirName, logFile))
+                match = self.match.match(logFile[plen:])
+
+                if match:
+                    result.append((os.path.join(dirName, logFile), match))
+
+        # 仅按大小切换时当前写入的日志没有后缀，与按时间切换时一样计入保留数量
+        if self.when is None and os.path.isfile(self.baseFilename):
+            result.append((self.baseFilename, self.match.match("")))
+
+        # 同一时间的日志中未编号的是当前写入的日志，排在最后
+        result.sort(key=lambda x: (x[1].group("time"), int(x[1].group("index") or sys.maxsize)))
+
+        return result
+
+
+    def next_index(self):
+        """ 计算当前日志按大小切换后的序号
+
+        :返回: 序号
+        """
+
+        current = os.path.basename(self.baseFilename)[len(os.path.basename(self.logFile)) + 1:]
+        indexes = [ int(match.group("index")) for _, match in self.list_logfile()
+                    if match.group("index") and match.group("time") == current ]
+
+        return max(indexes or [0]) + 1
+
+
+    def compress_logfile(self, logFile):
+        """ 压缩日志并删除原文件，多个进程同时压缩时以最后完成的为准
+
+        :参数 logFile: 日志文件
+        """
+
+        target = logFile + (".gz" if self.compress == "gzip" else ".zst")
+        temp = "%s.%s.tmp" % (target, os.getpid())
+
+        try:
+            with open(logFile, "rb") as src, open(temp, "wb") as fd:
+                if self.compress == "gzip":
+                    dst = gzip.GzipFile(fileobj=fd, mode="wb")
+                else:
+                    dst = zstandard.ZstdCompressor().stream_writer(fd)
+
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+                dst.close()
+
+            os.rename(temp, target)
+            os.remove(logFile)
+
+        except (IOError, OSError):
+            if os.path.exists(temp):
+                os.remove(temp)
+
+
+    def get_logfile_to_delete(self):
+        """ 列出不满足保留条件的日志
         
-        result.sort()
+        :返回: 待删除的日志文件列表
+        """
+
+        result = [ logFile for logFile, _ in self.list_logfile() ]
 
         if len(result) < self.retain:
             result = []
@@ -89,19 +351,212 @@ class MultiProcLogHandler(logging.FileHandler):
         return result  
 
 
+    def maintain(self):
+        """ 压缩除当前写入日志外的已切换日志，并删除不满足保留条件的日志 """
+
+        if self.compress:
+            # 等待其他进程发现日志已切换，避免压缩时仍有日志写入
+            time.sleep(self.compressDelay)
+
+            for logFile, _ in self.list_logfile():
+                if not logFile.endswith((".gz", ".zst")) and logFile != self.baseFilename:
+                    self.compress_logfile(logFile)
+
+        if self.retain > 0:
+            for logFile in self.get_logfile_to_delete():
+                try:
+                    os.remove(logFile)
+                except OSError:
+                    # 多进程同时切换时日志可能已被其他进程删除
+                    pass
+
+
+    def maintain_loop(self):
+        """ 后台清理线程：执行期间有新的清理请求时再执行一次 """
+
+        while True:
+            with self.cleanerLock:
+                if not self.pending:
+                    self.cleaner = None
+                    return
+
+                self.pending = False
+
+            try:
+                self.maintain()
+            except Exception:
+                if logging.raiseExceptions:
+                    traceback.print_exc(file=sys.stderr)
+
+
+    def delete_logfile(self):
+        """ 删除不满足保留条件的日志并压缩已切换的日志，仅在初始化与切换日志时执行，压缩总是在后台线程中进行 """
+
+        if self.retain <= 0 and not self.compress:
+            return
+
+        if not self.background and not self.compress:
+            return self.maintain()
+
+        with self.cleanerLock:
+            self.pending = True
+
+            if self.cleaner is not None and self.cleaner.is_alive():
+                return
+
+            self.cleaner = threading.Thread(target=self.maintain_loop)
+            self.cleaner.daemon = True
+            self.cleaner.start()
+
+
+    def start_writer(self):
+        """ 启动异步写入线程，fork 后的子进程在首次写入日志时重新启动 """
+
+        self.pid = os.getpid()
+        self.records = deque()
+        self.condition = threading.Condition()
+        self.closing = False
+
+        self.writer = threading.Thread(target=self.write_loop)
+        self.writer.daemon = True
+        self.writer.start()
+
+
+    def enqueue(self, record):
+        """ 格式化日志并放入异步写入队列，队列已满时按 policy 处理
+
+        :参数 record: 日志条目
+        """
+
+        if self.pid != os.getpid():
+            self.start_writer()
+
+        # 在调用线程中格式化，避免日志参数在写入前被修改
+        message = self.format(record) + self.terminator
+
+        with self.condition:
+            while len(self.records) >= self.queueSize and not self.closing:
+                # 队列已满时立即唤醒写入线程，不等待 flushInterval
+                self.condition.notify_all()
+
+                if self.policy == "drop-oldest":
+                    self.records.popleft()
+                    self.dropped += 1
+
+                elif self.policy == "drop-below-level" and record.levelno < self.dropLevel:
+                    self.dropped += 1
+                    return
+
+                else:
+                    self.condition.wait()
+
+            self.records.append((record.created, message))
+
+            if len(self.records) >= self.wakeSize:
+                self.condition.notify_all()
+
+
+    def write_loop(self):
+        """ 异步写入线程：攒批后一次写入日志文件，队列为空且已关闭时退出 """
+
+        while True:
+            with self.condition:
+                if len(self.records) < self.wakeSize and not self.closing:
+                    self.condition.wait(self.flushInterval)
+
+                batch = list(self.records)
+                self.records.clear()
+                closing = self.closing
+
+                # 唤醒等待队列空间的线程
+                self.condition.notify_all()
+
+            if batch:
+                try:
+                    self.write_batch(batch)
+                except Exception:
+                    if logging.raiseExceptions:
+                        traceback.print_exc(file=sys.stderr)
+
+            elif closing:
+                return
+
+
+    def write_batch(self, batch):
+        """ 将一批日志合并写入日志文件，跨越切换时间点时先写入旧日志再切换
+
+        :参数 batch: 日志列表 [(创建时间, 格式化后的日志), ...]
+        """
+
+        chunk = []
+
+        if self.check_size():
+            self.rotate_size()
+
+        for created, message in batch:
+            if created >= self.rolloverAt:
+                self.write_chunk(chunk)
+                chunk = []
+
+                self.rollover(created)
+
+            chunk.append(message)
+
+        self.write_chunk(chunk)
+
+
+    def write_chunk(self, chunk):
+        """ 写入并刷新一组日志
+
+        :参数 chunk: 格式化后的日志列表
+        """
+
+        if not chunk:
+            return
+
+        if self.stream is None:
+            self.stream = self._open()
+
+        self.stream.write("".join(chunk))
+        self.stream.flush()
+
+
+    def close(self):
+        """ 关闭日志，异步模式下先写完队列中剩余的日志，并等待后台压缩与清理完成 """
+
+        if self.writer is not None and self.pid == os.getpid():
+            with self.condition:
+                self.closing = True
+                self.condition.notify_all()
+
+            self.writer.join()
+
+        self.writer = None
+
+        # 等待后台线程完成压缩与清理
+        cleaner = self.cleaner
+
+        if cleaner is not None and cleaner.is_alive():
+            cleaner.join()
+
+        super(MultiProcLogHandler, self).close()
+
+
     def emit(self, record):
-        """ 记录日志 切换日志 删除日志 
+        """ 记录日志 切换日志 删除日志，异步模式下仅放入写入队列
         
         :参数 record: 日志条目
         """
  
         try:
-            if self.check_switch():
-                self.switch_log()
+            if self.writer is not None:
+                return self.enqueue(record)
+
+            if record.created >= self.rolloverAt:
+                self.rollover(record.created)
 
-            if self.retain > 0:
-                for s in self.get_logfile_to_delete():
-                    os.remove(s)
+            elif self.check_size():
+                self.rotate_size()
 
             logging.FileHandler.emit(self, record)
             
@@ -112,6 +567,314 @@ class MultiProcLogHandler(logging.FileHandler):
             self.handleError(record)
 
 
+class MultiProcLogCollector(object):
+
+    def __init__(self, address, handler, timeout=5):
+        """ 初始化日志收集服务，所有工作进程通过Unix套接字发送日志，由本服务统一写入、切换和删除日志
+
+        :参数 address: Unix套接字路径
+        :参数 handler: 写入日志的 handler，如 MultiProcLogHandler
+        :参数 timeout: 停止服务时等待每个连接写完已收到日志的最长秒数, 默认: 5
+        """
+
+        self.address = address
+        self.handler = handler
+        self.timeout = timeout
+        self.sock = None
+        self.conns = set()
+        self.threads = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+
+    def listen(self):
+        """ 监听Unix套接字，删除上次运行遗留的套接字文件 """
+
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.address)
+        self.sock.listen(128)
+
+
+    def serve_forever(self):
+        """ 接收工作进程的连接，每个连接使用独立的线程读取日志，调用 stop 后返回 """
+
+        if self.sock is None:
+            self.listen()
+
+        while not self.stopped.is_set():
+            try:
+                conn, _ = self.sock.accept()
+            except (IOError, OSError):
+                break
+
+            with self.lock:
+                self.conns.add(conn)
+
+            thread = threading.Thread(target=self.serve, args=(conn,))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+
+    def serve(self, conn):
+        """ 读取单个连接发送的日志并写入日志，每条日志格式为 4字节长度 + pickle序列化的日志属性字典，与 logging.handlers.SocketHandler 相同
+
+        :参数 conn: 工作进程连接
+        """
+
+        fd = conn.makefile("rb")
+
+        try:
+            while True:
+                header = fd.read(4)
+
+                if len(header) < 4:
+                    break
+
+                data = fd.read(struct.unpack(">L", header)[0])
+                record = logging.makeLogRecord(pickle.loads(data))
+
+                if record.levelno >= self.handler.level:
+                    self.handler.handle(record)
+
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            pass
+
+        finally:
+            fd.close()
+            conn.close()
+
+            with self.lock:
+                self.conns.discard(conn)
+
+
+    def start(self):
+        """ 在后台线程中运行收集服务
+
+        :返回: 收集服务
+        """
+
+        self.listen()
+
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        return self
+
+
+    def stop(self):
+        """ 停止收集服务，写完各连接已发送的日志后返回，不关闭 handler """
+
+        self.stopped.set()
+
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except (IOError, OSError):
+                pass
+
+            self.sock.close()
+
+        # 关闭连接的读方向后，读取线程读完缓冲区中已收到的日志即读到 EOF 并退出，不必等待工作进程断开
+        with self.lock:
+            conns = list(self.conns)
+
+        for conn in conns:
+            try:
+                conn.shutdown(socket.SHUT_RD)
+            except (IOError, OSError):
+                pass
+
+        for thread in self.threads:
+            thread.join(self.timeout)
+
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+
+class MultiProcLogClient(logging.Handler):
+
+    def __init__(self, address, batchSize=256, flushInterval=0.5, queueSize=10000):
+        """ 初始化工作进程日志 handler，日志逐条序列化、攒批后一次发送到 MultiProcLogCollector
+
+        :参数 address: 收集服务的Unix套接字路径
+        :参数 batchSize: 缓存的日志达到该数量时立即发送, 默认: 256
+        :参数 flushInterval: 缓存的日志最长等待发送的秒数, 默认: 0.5
+        :参数 queueSize: 收集服务不可用时最多缓存的日志数量，超出时丢弃最早的日志, 默认: 10000
+        """
+
+        logging.Handler.__init__(self)
+
+        self.address = address
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.queueSize = queueSize
+        self.records = deque()
+        self.dropped = 0
+        self.sock = None
+        self.pid = None
+        self.flusher = None
+        self.closed = False
+
+
+    def prepare(self, record):
+        """ 将日志转换为属性字典并序列化为 4字节长度 + pickle 的数据帧，日志参数与异常信息在工作进程中格式化
+
+        :参数 record: 日志条目
+        :返回: 数据帧
+        """
+
+        attrs = dict(record.__dict__)
+        attrs["msg"] = record.getMessage()
+        attrs["args"] = None
+        attrs["exc_info"] = None
+        attrs.pop("message", None)
+
+        if record.exc_info and not record.exc_text:
+            attrs["exc_text"] = logging.Formatter().formatException(record.exc_info)
+
+        data = pickle.dumps(attrs, 2)
+
+        return struct.pack(">L", len(data)) + data
+
+
+    def reset(self):
+        """ 启动定时发送线程，fork 后的子进程丢弃父进程缓存的日志并使用独立的连接与线程 """
+
+        self.pid = os.getpid()
+        self.records.clear()
+        self.sock = None
+        self.flusher = threading.Thread(target=self.flush_loop)
+        self.flusher.daemon = True
+        self.flusher.start()
+
+
+    def connect(self):
+        """ 连接收集服务
+
+        :返回: 套接字
+        """
+
+        if self.sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.address)
+            self.sock = sock
+
+        return self.sock
+
+
+    def flush_loop(self):
+        """ 定时发送缓存的日志 """
+
+        pid = os.getpid()
+
+        while not self.closed and self.pid == pid:
+            time.sleep(self.flushInterval)
+
+            try:
+                self.flush()
+            except Exception:
+                if logging.raiseExceptions:
+                    traceback.print_exc(file=sys.stderr)
+
+
+    def send(self):
+        """ 发送缓存的日志，发送失败时保留日志等待下次重试 """
+
+        if not self.records:
+            return
+
+        batch = list(self.records)
+
+        try:
+            self.connect().sendall(b"".join(batch))
+
+        except (IOError, OSError):
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+
+            return
+
+        for _ in range(len(batch)):
+            self.records.popleft()
+
+
+    def flush(self):
+        """ 发送缓存的日志 """
+
+        self.acquire()
+
+        try:
+            self.send()
+        finally:
+            self.release()
+
+
+    def emit(self, record):
+        """ 缓存日志，达到 batchSize 时发送
+
+        :参数 record: 日志条目
+        """
+
+        try:
+            if self.pid != os.getpid():
+                self.reset()
+
+            # 逐条序列化，无法序列化的日志(如 extra 中包含锁)直接丢弃，不影响后续日志
+            try:
+                frame = self.prepare(record)
+            except Exception:
+                self.dropped += 1
+                raise
+
+            if len(self.records) >= self.queueSize:
+                self.records.popleft()
+                self.dropped += 1
+
+            self.records.append(frame)
+
+            if len(self.records) >= self.batchSize:
+                self.send()
+
+        except (KeyboardInterrupt, SystemExit):
+            raise
+
+        except:
+            self.handleError(record)
+
+
+    def close(self):
+        """ 发送剩余日志并关闭连接 """
+
+        self.acquire()
+
+        try:
+            self.closed = True
+            self.send()
+
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+
+        finally:
+            self.release()
+
+        logging.Handler.close(self)
+
+
 if __name__ == "__main__":
     logHandler = MultiProcLogHandler(logfile="./test.log", when="D", retain=2)
     logHandler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
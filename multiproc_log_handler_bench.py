@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import getopt
+import gzip
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+from multiproc_log_handler import MultiProcLogClient, MultiProcLogCollector, MultiProcLogHandler
+
+try:
+    from time import perf_counter as clock
+except:
+    from time import time as clock
+
+
+def syscalls():
+    """ 读取当前进程的 read/write 类系统调用次数(/proc/self/io 的 syscr + syscw)，仅支持 Linux
+    不包括 stat、lseek、flock、listdir 等其他系统调用
+
+    :返回: 读写系统调用次数，无法读取时返回 None
+    """
+
+    try:
+        with open("/proc/self/io") as fd:
+            stats = dict( line.split(":") for line in fd.read().splitlines() )
+    except (IOError, OSError):
+        return None
+
+    return int(stats["syscr"]) + int(stats["syscw"])
+
+
+def make_handler(mode, logfile, when, address):
+    """ 按测试模式创建 handler
+
+    :参数 mode: sync (同步写入) / async (异步写入) / size (同步写入并按大小切换) / gzip (按大小切换并压缩) / collector (发送到收集服务)
+    :参数 logfile: 日志文件
+    :参数 when: 日志切换周期
+    :参数 address: 收集服务的Unix套接字路径
+    :返回: handler
+    """
+
+    if mode == "collector":
+        return MultiProcLogClient(address)
+
+    if mode == "async":
+        return MultiProcLogHandler(logfile, when, retain=0, queueSize=10000)
+
+    if mode in ("size", "gzip"):
+        return MultiProcLogHandler(logfile, when, retain=0, maxBytes=1024 * 1024, compress=mode == "gzip" and "gzip" or None)
+
+    return MultiProcLogHandler(logfile, when, retain=0)
+
+
+def worker(mode, logfile, when, address, proc, records, recordBytes, started, result):
+    """ 在子进程中写入日志，统计每条日志的耗时与读写系统调用次数
+
+    :参数 mode: 测试模式
+    :参数 logfile: 日志文件
+    :参数 when: 日志切换周期
+    :参数 address: 收集服务的Unix套接字路径
+    :参数 proc: 进程编号
+    :参数 records: 日志数量
+    :参数 recordBytes: 单条日志的字节数
+    :参数 started: 开始写入的事件，所有进程就绪后同时开始
+    :参数 result: 返回结果的队列
+    """
+
+    handler = make_handler(mode, logfile, when, address)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+
+    log = logging.getLogger("bench")
+    log.setLevel(logging.INFO)
+    log.addHandler(handler)
+
+    # 每行格式: 进程编号 序号 填充内容，长度固定便于检测截断与交错
+    payload = "x" * max(recordBytes - 16, 1)
+    latencies = []
+
+    started.wait()
+    before = syscalls()
+
+    for seq in range(records):
+        began = clock()
+        log.info("%04d %010d %s", proc, seq, payload)
+        latencies.append(clock() - began)
+
+    handler.close()
+    after = syscalls()
+
+    result.put({"latencies": latencies, "syscalls": None if before is None else after - before})
+
+
+def verify(root, procs, records, recordBytes):
+    """ 读取所有日志(包括压缩的日志)，按文件切换顺序检查丢失、重复、截断与乱序的日志
+
+    :参数 root: 日志目录
+    :参数 procs: 进程数
+    :参数 records: 每个进程的日志数量
+    :参数 recordBytes: 单条日志的字节数
+    :返回: {"lines", "lost", "duplicated", "broken", "disordered", "files"}
+    """
+
+    pattern = re.compile(r"^(\d{4}) (\d{10}) x+$")
+    lineBytes = 4 + 1 + 10 + 1 + max(recordBytes - 16, 1)
+    seen = set()
+    last = {}
+    counts = {"lines": 0, "broken": 0, "duplicated": 0, "disordered": 0, "files": 0}
+
+    def order(name):
+        # bench.log[.时间][.序号][.gz]，同一时间中未编号的当前日志排在最后
+        parts = name[len("bench.log"):].replace(".gz", "").split(".")[1:]
+        index = parts[-1] if parts and parts[-1].isdigit() else None
+        suffix = ".".join(parts[:-1] if index else parts)
+        return suffix, int(index) if index else sys.maxsize
+
+    names = sorted([ name for name in os.listdir(root) if name.startswith("bench.log") and not name.endswith((".lock", ".tmp")) ], key=order)
+
+    for name in names:
+        counts["files"] += 1
+        opener = gzip.open if name.endswith(".gz") else open
+
+        with opener(os.path.join(root, name), "rb") as fd:
+            for line in fd.read().decode("utf-8").splitlines():
+                counts["lines"] += 1
+                match = pattern.match(line)
+
+                if not match or len(line) != lineBytes:
+                    counts["broken"] += 1
+                    continue
+
+                key = (int(match.group(1)), int(match.group(2)))
+
+                if key in seen:
+                    counts["duplicated"] += 1
+                    continue
+
+                seen.add(key)
+
+                if key[1] < last.get(key[0], -1):
+                    counts["disordered"] += 1
+
+                last[key[0]] = key[1]
+
+    counts["lost"] = procs * records - len(seen)
+
+    return counts
+
+
+def percentile(values, rate):
+    """ 计算已排序数据的百分位数
+
+    :参数 values: 已排序的数据
+    :参数 rate: 百分位 0-100
+    :返回: 百分位数
+    """
+
+    if not values:
+        return 0
+
+    return values[min(len(values) - 1, int(len(values) * rate / 100.0))]
+
+
+def run_case(mode, procs, records, recordBytes, when):
+    """ 执行一组测试
+
+    :参数 mode: 测试模式
+    :参数 procs: 进程数
+    :参数 records: 每个进程的日志数量
+    :参数 recordBytes: 单条日志的字节数
+    :参数 when: 日志切换周期
+    :返回: 测试结果
+    """
+
+    ctx = multiprocessing.get_context("spawn") if hasattr(multiprocessing, "get_context") else multiprocessing
+    root = tempfile.mkdtemp()
+    logfile = os.path.join(root, "bench.log")
+    address = os.path.join(root, "collector.sock")
+    collector = None
+
+    # 收集模式下由当前进程统一写入日志
+    if mode == "collector":
+        collectorHandler = MultiProcLogHandler(logfile, when, retain=0, queueSize=10000)
+        collectorHandler.setFormatter(logging.Formatter("%(message)s"))
+        collector = MultiProcLogCollector(address, collectorHandler).start()
+
+    started = ctx.Event()
+    result = ctx.Queue()
+    workers = [ ctx.Process(target=worker, args=(mode, logfile, when, address, proc, records, recordBytes, started, result))
+                for proc in range(procs) ]
+
+    for proc in workers:
+        proc.start()
+
+    # 等待子进程完成导入与初始化
+    time.sleep(1)
+
+    collectorBefore = syscalls()
+    began = time.time()
+    started.set()
+    results = [ result.get() for _ in workers ]
+
+    for proc in workers:
+        proc.join()
+
+    if collector is not None:
+        collector.stop()
+        collectorHandler.close()
+
+    seconds = time.time() - began
+    counts = verify(root, procs, records, recordBytes)
+    shutil.rmtree(root)
+
+    latencies = sorted( x for r in results for x in r["latencies"] )
+    calls = None
+
+    if all( r["syscalls"] is not None for r in results ):
+        calls = sum( r["syscalls"] for r in results )
+
+        if collector is not None:
+            calls += syscalls() - collectorBefore
+
+    counts.update({
+        "mode": mode,
+        "seconds": seconds,
+        "recordsPerSecond": procs * records / seconds,
+        "p50": percentile(latencies, 50) * 1000000,
+        "p99": percentile(latencies, 99) * 1000000,
+        "rwSyscallsPerRecord": None if calls is None else calls / float(procs * records),
+    })
+
+    return counts
+
+
+def benchmark(modes, procsList, records, recordBytes, when):
+    """ 遍历 测试模式 x 进程数 执行测试并输出结果
+
+    :参数 modes: 测试模式列表 [sync, async, size, gzip, collector]
+    :参数 procsList: 进程数列表
+    :参数 records: 每个进程的日志数量
+    :参数 recordBytes: 单条日志的字节数
+    :参数 when: 日志切换周期 [S, M, H, D]
+    :返回: 结果列表
+    """
+
+    results = []
+
+    print("%-10s %5s %9s %11s %9s %9s %12s %7s %7s %7s %6s" % (
+        "mode", "procs", "seconds", "records/s", "p50(us)", "p99(us)", "rw-syscall/r", "lost", "broken", "order", "files"))
+
+    for mode in modes:
+        for procs in procsList:
+            result = run_case(mode, procs, records, recordBytes, when)
+            result["procs"] = procs
+            results.append(result)
+
+            print("%-10s %5s %9.2f %11.0f %9.1f %9.1f %12s %7s %7s %7s %6s" % (
+                mode, procs, result["seconds"], result["recordsPerSecond"], result["p50"], result["p99"],
+                "-" if result["rwSyscallsPerRecord"] is None else "%.3f" % result["rwSyscallsPerRecord"],
+                result["lost"] + result["duplicated"], result["broken"], result["disordered"], result["files"]))
+
+    return results
+
+
+if __name__ == "__main__":
+    message = """
+        [ 帮助 ]
+
+        --modes    测试模式列表 sync,async,size,gzip,collector, 默认: sync,async,collector
+        --procs    进程数列表, 默认: 1,4,8
+        --records  每个进程的日志数量, 默认: 20000
+        --size     单条日志的字节数(不少于17), 默认: 128
+        --when     日志切换周期 S/M/H/D, 默认: S
+
+        {} --modes sync,async,collector --procs 1,8 --records 50000 --size 256 --when S
+    """
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "h", ["help", "modes=", "procs=", "records=", "size=", "when="])
+        options = {"modes": ["sync", "async", "collector"], "procs": [1, 4, 8], "records": 20000, "size": 128, "when": "S"}
+
+        for name, value in opts:
+            if name in ("-h", "--help"):
+                print(message.format(sys.argv[0]))
+                sys.exit(0)
+
+            elif name == "--modes":
+                options["modes"] = value.split(",")
+
+            elif name == "--procs":
+                options["procs"] = [ int(x) for x in value.split(",") ]
+
+            elif name == "--when":
+                options["when"] = value
+
+            else:
+                options[name[2:]] = int(value)
+
+    except getopt.GetoptError:
+        print(message.format(sys.argv[0]))
+        sys.exit(1)
+
+    benchmark(modes=options["modes"], procsList=options["procs"], records=options["records"],
+              recordBytes=max(options["size"], 17), when=options["when"])
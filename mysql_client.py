@@ -1,7 +1,26 @@
 # -*-coding:utf-8-*-
 
+from array import array
+from collections import OrderedDict
+from itertools import islice
+
 from sqlalchemy import create_engine
 
+try:
+    import numpy
+except:
+    numpy = None
+
+
+# MySQLdb FIELD_TYPE: TINY, SHORT, LONG, LONGLONG, INT24, YEAR
+INTEGER_TYPES = (1, 2, 3, 8, 9, 13)
+
+# MySQLdb FIELD_TYPE: DECIMAL, FLOAT, DOUBLE, NEWDECIMAL
+FLOAT_TYPES = (0, 4, 5, 246)
+
+# 双精度浮点数可以精确表示的整数范围
+EXACT_FLOAT_INTEGER = 2 ** 53
+
 
 class MySQLClient(object):
 
@@ -39,6 +58,204 @@ class MySQLClient(object):
         return rows, data
 
 
+    def query_stream(self, sql, batchSize=1000, batches=False):
+        """ 使用服务端游标(SSCursor)流式查询，逐批从服务器读取数据，内存占用与结果集大小无关
+
+        :参数 sql: 指定查询数据库的SQL语句
+        :参数 batchSize: 每次从服务器读取的行数，默认: 1000
+        :参数 batches: 是否按批返回，默认: False (逐行返回)
+        :返回: 生成器，逐行或逐批(列表)返回查询的数据
+        """
+
+        conn = self.engine.connect()
+        finished = False
+
+        try:
+            cursor = conn.execution_options(stream_results=True).execute(sql)
+
+            while True:
+                rows = cursor.fetchmany(batchSize)
+
+                if not rows:
+                    break
+
+                if batches:
+                    yield rows
+                else:
+                    for row in rows:
+                        yield row
+
+            finished = True
+            cursor.close()
+
+        finally:
+            # 提前停止或出错时，关闭游标会读完服务器上剩余的数据，直接废弃该链接
+            if not finished:
+                conn.invalidate()
+
+            conn.close()
+
+
+    def column_types(self, description):
+        """ 根据游标的字段元数据推断每列的 array 类型码
+
+        :参数 description: DBAPI 游标的 description
+        :返回: 类型码列表，整数列为 q，允许NULL的整数列为 n (使用 d 类型的 array, NULL 记为 NaN)，
+               浮点数列为 d (NULL 记为 NaN)，其他列为 None (使用列表)
+        """
+
+        types = []
+
+        for column in description:
+            typeCode, nullable = column[1], column[6]
+
+            if typeCode in INTEGER_TYPES:
+                types.append("n" if nullable else "q")
+            elif typeCode in FLOAT_TYPES:
+                types.append("d")
+            else:
+                types.append(None)
+
+        return types
+
+
+    def query_columns(self, sql, batchSize=10000):
+        """ 按列查询数据，使用服务端游标逐批读取并直接追加到每列的 array 中，避免为每行创建Python对象
+
+        :参数 sql: 指定查询数据库的SQL语句
+        :参数 batchSize: 每次从服务器读取的行数，默认: 10000
+        :返回: 有序字典 {列名: array.array 或 列表}
+        """
+
+        conn = self.engine.connect()
+        finished = False
+
+        try:
+            cursor = conn.execution_options(stream_results=True).execute(sql)
+            description = cursor.cursor.description
+            types = self.column_types(description)
+            columns = [ array(code) if code else [] for code in types ]
+
+            while True:
+                rows = cursor.fetchmany(batchSize)
+
+                if not rows:
+                    break
+
+                for index, values in enumerate(zip(*rows)):
+                    columns[index], types[index] = self.append_column(columns[index], types[index], values)
+
+            finished = True
+            cursor.close()
+
+        finally:
+            # 出错时关闭服务端游标会读完服务器上剩余的数据，直接废弃该链接
+            if not finished:
+                conn.invalidate()
+
+            conn.close()
+
+        # 多表关联时可能出现同名的列 (SELECT a.id, b.id)，重复的列名依次追加序号: id, id_1, id_2
+        result = OrderedDict()
+
+        for column, values in zip(description, columns):
+            name, seq = column[0], 0
+
+            while name in result:
+                seq += 1
+                name = "%s_%d" % (column[0], seq)
+
+            result[name] = values
+
+        return result
+
+
+    def append_column(self, column, code, values):
+        """ 向列中追加一批数据，数据超出当前 array 类型的范围时转换列的类型，整数不会被转换为有损的浮点数
+
+        :参数 column: 列数据 array.array 或 列表
+        :参数 code: 列的类型码，参考 column_types，另外 Q 为超出 q 范围的无符号整数列
+        :参数 values: 该列的一批数据
+        :返回: (列数据, 类型码)
+        """
+
+        nan = float("nan")
+
+        if code is None:
+            column.extend(values)
+            return column, code
+
+        if code == "d":
+            column.extend([ nan if value is None else value for value in values ])
+            return column, code
+
+        if code == "n":
+            if all( value is None or -EXACT_FLOAT_INTEGER <= value <= EXACT_FLOAT_INTEGER for value in values ):
+                column.extend([ nan if value is None else value for value in values ])
+                return column, code
+
+            # 超出浮点数可以精确表示的范围，改为列表，NULL 记为 None
+            column = [ None if value != value else int(value) for value in column ]
+            column.extend(values)
+            return column, None
+
+        size = len(column)
+
+        try:
+            column.extend(values)
+            return column, code
+
+        except (TypeError, OverflowError):
+            # extend 失败前已追加的数据需要删除
+            del column[size:]
+
+        if None in values:
+            # 元数据声明不允许NULL的整数列出现NULL，改为以 NaN 记录 NULL 的整数列
+            if not column or -EXACT_FLOAT_INTEGER <= min(column) and max(column) <= EXACT_FLOAT_INTEGER:
+                return self.append_column(array("d", column), "n", values)
+
+        elif code == "q" and (not column or min(column) >= 0) and min(values) >= 0:
+            # BIGINT UNSIGNED 超出 q 的范围，改为无符号整数列
+            return self.append_column(array("Q", column), "Q", values)
+
+        column = list(column)
+        column.extend(values)
+
+        return column, None
+
+
+    def query_array(self, sql, batchSize=10000, structured=True):
+        """ 按列查询数据并转换为 NumPy 数组，数值列直接复用 array 的内存，需要安装 numpy
+
+        :参数 sql: 指定查询数据库的SQL语句
+        :参数 batchSize: 每次从服务器读取的行数，默认: 10000
+        :参数 structured: 是否返回结构化数组，默认: True，False 时返回 {列名: numpy.ndarray}
+        :返回: numpy 结构化数组 或 有序字典 {列名: numpy.ndarray}
+        """
+
+        if numpy is None:
+            raise ImportError("query_array 需要安装 numpy")
+
+        columns = OrderedDict()
+
+        for name, values in self.query_columns(sql, batchSize).items():
+            if isinstance(values, array):
+                columns[name] = numpy.frombuffer(values, dtype=values.typecode)
+            else:
+                columns[name] = numpy.array(values, dtype=object)
+
+        if not structured:
+            return columns
+
+        size = len(next(iter(columns.values()))) if columns else 0
+        result = numpy.empty(size, dtype=[ (str(name), values.dtype) for name, values in columns.items() ])
+
+        for name, values in columns.items():
+            result[str(name)] = values
+
+        return result
+
+
     def modify(self, sql):
         """ 数据库DML语句
 
@@ -64,12 +281,64 @@ class MySQLClient(object):
         return rows, pkid
 
 
+    def modify_many(self, sql, rows, batchSize=1000, commit="batch"):
+        """ 批量执行参数化的DML语句，按批次通过 executemany 发送，INSERT 语句由驱动合并为多行 VALUES
+
+        :参数 sql: 参数化的SQL语句，如 "INSERT INTO test (id, name) VALUES (%s, %s)" 或 "... VALUES (%(id)s, %(name)s)"
+        :参数 rows: 参数列表或迭代器，元素为元组或字典
+        :参数 batchSize: 每批发送的行数，默认: 1000
+        :参数 commit: 提交方式 [batch (每批提交一次), all (全部执行完成后提交一次)], 默认: batch
+        :返回: 被修改的总行数
+        """
+
+        if commit not in ("batch", "all"):
+            raise ValueError("不支持的提交方式: %s" % commit)
+
+        rows = iter(rows)
+        total = 0
+        conn = self.engine.connect()
+
+        try:
+            trans = conn.begin()
+
+            try:
+                while True:
+                    batch = list(islice(rows, batchSize))
+
+                    if not batch:
+                        break
+
+                    total += conn.execute(sql, batch).rowcount
+
+                    if commit == "batch":
+                        trans.commit()
+                        trans = conn.begin()
+
+                trans.commit()
+
+            except:
+                # 每批提交时已提交的批次不会回滚
+                trans.rollback()
+                raise
+
+        finally:
+            conn.close()
+
+        return total
+
+
 if __name__ == "__main__":
     mysql = MySQLClient(host="127.0.0.1", port=3306, username="test", password="test", db="test")
     mysql.query("SELECT 1+1")
+
+    for row in mysql.query_stream("SELECT * FROM test", batchSize=5000):
+        print(row)
+
+    print(mysql.query_columns("SELECT id, name FROM test"))
     mysql.modify("INSERT INTO test (id, name) VALUES (1, 'test')")
     mysql.modify("UPDATE test set name='test1' WHERE id = 1")
     mysql.modify("DELETE FROM test WHERE id = 1")
+    mysql.modify_many("INSERT INTO test (id, name) VALUES (%s, %s)", ( (i, "test%s" % i) for i in range(100000) ), batchSize=5000)
 
 
 